@@ -1,22 +1,47 @@
 
 config = {
-    'dataset_pickle_file': './dataset.pickle',
+    'dataset': {
+        'folder': './dataset/store',
+        'dtype': 'uint8',
+        'shard_size': 20000,
+        'seed': 0
+    },
     'model_file': './model.ckpt',
+    'inference_model': {
+        # Backend that runs the model: tensorflow or numpy (from the weights file, without importing TensorFlow)
+        'backend': 'tensorflow',
+        # Model loaded to process boards: checkpoint, frozen (graph with constant weights) or weights (numpy file)
+        'format': 'checkpoint',
+        'graph_file': './model.pb',
+        'dense_graph_file': './model_dense.pb',
+        'export_weights': True,
+        'weights_file': './model_weights.npz',
+        # Quantization of the fully connected layers in the weights file of the numpy backend: None, int8 or float16.
+        # It makes the file smaller, the layers still run in float32
+        'quantization': None,
+        'quantized_weights_file': './model_weights_quantized.npz'
+    },
     'num_labels': 4,
     'image_size': 28,
     'image_channels': 1,
     'test_dataset_percentage': 0.05,
+    'loader_workers': 0,
+    'loader_chunk_size': 64,
     'item': {
         'original_folder': './dataset/items_original',
         'objects_folder': './dataset/item_objects',
         'generated_folder': './dataset/items_generated',
-        'folder': './dataset/items'
+        'folder': './dataset/items',
+        'background_size': [400, 500],
+        'generated_count': 4000
     },
     'relation': {
         'original_folder': './dataset/relations_original',
         'objects_folder': './dataset/relation_objects',
         'generated_folder': './dataset/relations_generated',
-        'folder': './dataset/relations'
+        'folder': './dataset/relations',
+        'background_size': [700, 850],
+        'generated_count': 3000
     },
     'user': {
         'original_folder': './dataset/users_original',
@@ -29,7 +54,71 @@ config = {
         'original_folder': './dataset/outliers_original',
         'folder': './dataset/outliers'
     },
+    'training': {
+        'batch_size': 10,
+        'num_steps': 10000,
+        'learning_rate': 1e-4,
+        # constant, exponential or step
+        'learning_rate_schedule': 'constant',
+        'learning_rate_decay': 0.5,
+        'learning_rate_decay_steps': 5000,
+        # Scale the learning rate linearly with the batch size, starting from base_batch_size
+        'learning_rate_scaling': False,
+        'base_batch_size': 10,
+        # Batches prepared in advance by the input thread
+        'prefetch_batches': 8
+    },
+    'augmentation': {
+        'enabled': False,
+        'seed': 0,
+        # Rotations of each label, as times the image is rotated 90 degrees
+        'rotations': {0: [0, 1, 2, 3], 1: [0, 2], 2: [0], 3: [0, 1, 2, 3]},
+        # Part of each batch replaced by synthetic items and relations
+        'synthetic_fractions': {0: 0.25, 1: 0.2}
+    },
+    'session': {
+        # Threads used inside an op and to run independent ops, 0 lets TensorFlow use all the cores
+        'intra_op_threads': 0,
+        'inter_op_threads': 0,
+        # CPUs each process is bound to, e.g. [0, 1] or None for all of them
+        'cpu_affinity': None,
+        # Device where the model is placed, e.g. '/cpu:0' or None to let TensorFlow choose
+        'device': None,
+        'allow_soft_placement': True,
+        'log_device_placement': False
+    },
     'match_min_confidence': 0.9,
     'match_max_shared_zone': 0.35,
+    'window_batch_size': 512,
+    # First stage of the sliding window, rejects the windows of blank background before the model.
+    # The thresholds are on normalized pixels, tests/cascade_recall.py reports the recall lost with them
+    'cascade': {
+        'enabled': False,
+        'min_std': 0.03,
+        'min_edge_density': 0.01,
+        'edge_threshold': 0.1
+    },
+    # Score all the windows with one pass of the dense model. It is faster but approximates the sliding window, so it
+    # changes the elements found (tests/dense_scoring_parity.py). Only the tensorflow backend supports it
+    'dense_scoring': False,
+    'ocr_workers': 4,
+    'ocr_timeout': 30,
+    'result_cache': {
+        'enabled': False,
+        'folder': './cache/results',
+        'max_size': 256 * 1024 * 1024
+    },
+    'ocr_cache': {
+        'max_entries': 4096,
+        'disk_enabled': False,
+        'folder': './cache/ocr',
+        'max_size': 64 * 1024 * 1024
+    },
+    'profiling': {
+        # Timers and counters of each board and training session, logged as JSON
+        'enabled': True,
+        # Add the profile of each board to its response
+        'in_response': False
+    },
     'log_level': 'DEBUG'
 }
\ No newline at end of file
@@ -1,42 +1,157 @@
-import random
+import getopt
+import multiprocessing
+import os
+import sys
+import numpy as np
 from scipy import misc
 from config import config
 from utils import image_utils
 from utils import data_utils
+from utils import dataset_utils
+from utils.build_utils import BuildManifest
 from utils.logger import Logger
 
 logger = Logger('generate')
 
-relation_objects, n = image_utils.load_original_images(config['relation']['objects_folder'])
-item_objects, n = image_utils.load_original_images(config['item']['objects_folder'])
-relation_backgrounds, n = image_utils.load_original_images(config['backgrounds']['original_folder'], image_size=[700, 850])
-item_backgrounds, n = image_utils.load_original_images(config['backgrounds']['original_folder'], image_size=[400, 500])
-
-
-def append_images(object_image, background, dest):
-    object_image = image_utils.clean_shape(object_image)
-    background = image_utils.clean_shape(background)
-    object_size = object_image.shape
-    background_size = background.shape
-    position = [
-        (background_size[0] - object_size[0]) // 2,
-        (background_size[1] - object_size[1]) // 2,
-    ]
-    background[position[0]:object_size[0] + position[0], position[1]:object_size[1] + position[1]] = object_image
-    misc.imsave(dest, background)
-
-data_utils.clean_directory(config['relation']['generated_folder'])
-for i in range(3000):
-    relation_object = random.choice(relation_objects)
-    background = random.choice(relation_backgrounds)
-    append_images(relation_object, background, config['relation']['generated_folder'] + '/' + str(i) + '.jpg')
-    if i % 100 == 0:
-        logger.info('Generated %d relations' % i)
-
-data_utils.clean_directory(config['item']['generated_folder'])
-for i in range(4000):
-    item_object = random.choice(item_objects)
-    background = random.choice(item_backgrounds)
-    append_images(item_object, background, config['item']['generated_folder'] + '/' + str(i) + '.jpg')
-    if i % 100 == 0:
-        logger.info('Generated %d items' % i)
+chunk_size = 50
+
+
+def init_worker(objects, backgrounds, background_size):
+    """Set the images the worker process composes the samples from"""
+    global worker_objects, worker_backgrounds, worker_background_size
+    worker_objects = objects
+    worker_backgrounds = backgrounds
+    worker_background_size = background_size
+
+
+def compose_sample(label, index, seed):
+    """Object, background and image of a synthetic sample, always the same for the same label, index and seed"""
+    random = np.random.RandomState([seed, label, index])
+    object_index = random.randint(len(worker_objects))
+    background_index = random.randint(len(worker_backgrounds))
+    size = random.randint(worker_background_size[0], worker_background_size[1] + 1)
+    background = image_utils.resize_image(worker_backgrounds[background_index], size, size)
+    return object_index, background_index, image_utils.paste_image(worker_objects[object_index], background)
+
+
+def generate_chunk(task):
+    """Compose the samples of a chunk of indexes, writing them as files or returning them ready for the dataset"""
+    label, indices, seed, folder, output_format = task
+    sources = []
+    images = []
+    for index in indices:
+        object_index, background_index, image = compose_sample(label, index, seed)
+        sources.append((object_index, background_index))
+        if output_format == 'store':
+            images.append(image_utils.resize_image(image, config['image_size'], config['image_size']))
+        else:
+            misc.imsave(os.path.join(folder, '%d.%s' % (index, output_format)), image)
+    if images:
+        images = image_utils.normalize_image(np.array(images, dtype=np.float32))
+    return indices, sources, images
+
+
+def generate_images(label, label_config, backgrounds, background_names, total_images, seed, output_format, workers,
+                    incremental, writer):
+    objects, object_names = image_utils.load_original_images(label_config['objects_folder'])
+    params = {'background_size': label_config['background_size'], 'seed': seed}
+
+    manifest = None
+    folder = label_config['generated_folder']
+    indices = list(range(total_images))
+    generated_key = 'generated/%d/%d' % (label, seed)
+    if output_format == 'store':
+        # The samples of a label and seed replace the ones written before, unless they are the same
+        store_params = dict(params, count=total_images, objects=object_names, backgrounds=background_names)
+        if incremental and writer.generated.get(generated_key) == store_params:
+            logger.info('%s is up to date in the dataset' % generated_key)
+            return
+        writer.replace_generated(generated_key, store_params)
+    else:
+        if not incremental:
+            data_utils.clean_directory(folder)
+        elif not os.path.exists(folder):
+            os.makedirs(folder)
+
+        # Only generate the samples whose object, background or parameters changed
+        manifest = BuildManifest(folder)
+        outputs = ['%d.%s' % (i, output_format) for i in indices]
+        indices = [i for i in indices if not manifest.is_fresh(outputs[i], params)]
+
+    tasks = [(label, indices[i:i + chunk_size], seed, folder, output_format) for i in range(0, len(indices), chunk_size)]
+    total_generated = 0
+    with multiprocessing.Pool(workers or None, initializer=init_worker,
+                              initargs=(objects, backgrounds, label_config['background_size'])) as pool:
+        for chunk_indices, sources, images in pool.imap(generate_chunk, tasks):
+            if output_format == 'store':
+                writer.append(images, [label] * len(images), generated=generated_key)
+            else:
+                for index, (object_index, background_index) in zip(chunk_indices, sources):
+                    manifest.record(outputs[index], [
+                        os.path.join(label_config['objects_folder'], object_names[object_index]),
+                        os.path.join(config['backgrounds']['original_folder'], background_names[background_index])
+                    ], params)
+            total_generated += len(chunk_indices)
+            logger.info('Generated %d/%d images of %s' %
+                        (total_generated, len(indices), label_config['objects_folder']))
+        pool.close()
+        pool.join()
+
+    if manifest is not None:
+        manifest.remove_stale(outputs)
+        manifest.save()
+    else:
+        writer.complete_generated(generated_key)
+
+
+def main(argv):
+    help_text = 'Usage: generate.py [--relations <count>] [--items <count>] [--seed <seed>] ' \
+                '[--format <jpg|png|store>] [--workers <count>] [--incremental]'
+    try:
+        opts, args = getopt.getopt(argv, "hr:i:s:f:w:", ['help', 'relations=', 'items=', 'seed=', 'format=',
+                                                         'workers=', 'incremental'])
+    except getopt.GetoptError:
+        print(help_text)
+        sys.exit(2)
+
+    total_relations = config['relation']['generated_count']
+    total_items = config['item']['generated_count']
+    seed = 0
+    output_format = 'jpg'
+    workers = 0
+    incremental = False
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print(help_text)
+            sys.exit()
+        elif o in ("-r", "--relations"):
+            total_relations = int(a)
+        elif o in ("-i", "--items"):
+            total_items = int(a)
+        elif o in ("-s", "--seed"):
+            seed = int(a)
+        elif o in ("-f", "--format"):
+            output_format = a
+        elif o in ("-w", "--workers"):
+            workers = int(a)
+        elif o == "--incremental":
+            incremental = True
+
+    if output_format not in ('jpg', 'png', 'store'):
+        print(help_text)
+        sys.exit(2)
+
+    # The samples are written to the training dataset instead of as images, replacing the ones of the same seed
+    writer = None
+    if output_format == 'store':
+        writer = dataset_utils.DatasetWriter(config['dataset']['folder'], append=True)
+
+    backgrounds, background_names = image_utils.load_original_images(config['backgrounds']['original_folder'])
+    generate_images(1, config['relation'], backgrounds, background_names, total_relations, seed, output_format,
+                    workers, incremental, writer)
+    generate_images(0, config['item'], backgrounds, background_names, total_items, seed, output_format,
+                    workers, incremental, writer)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,62 +1,53 @@
-import numpy as np
-from random import shuffle
-from six.moves import cPickle as pickle
+import sys
 from config import config
 from utils import image_utils
+from utils import dataset_utils
+from utils import build_utils
 from utils.logger import Logger
 
 logger = Logger('load')
 
-items_train_dataset = image_utils.load_model_images(config['item']['folder'])
-relations_train_dataset = image_utils.load_model_images(config['relation']['folder'])
-users_train_dataset = image_utils.load_model_images(config['user']['folder'])
-outliers_train_dataset = image_utils.load_model_images(config['outlier']['folder'])
-labels = []
-
-for i in range(len(items_train_dataset)):
-    labels.append(0)
-for i in range(len(relations_train_dataset)):
-    labels.append(1)
-for i in range(len(users_train_dataset)):
-    labels.append(2)
-for i in range(len(outliers_train_dataset)):
-    labels.append(3)
-
-dataset = items_train_dataset + relations_train_dataset + users_train_dataset + outliers_train_dataset
-
-# Shuffle dataset
-relation1_shuf = []
-relation2_shuf = []
-index_shuf = list(range(len(dataset)))
-shuffle(index_shuf)
-for i in index_shuf:
-    relation1_shuf.append(dataset[i])
-    relation2_shuf.append(labels[i])
-dataset = np.asarray(relation1_shuf)
-labels = np.asarray(relation2_shuf)
-
-dataset = dataset.reshape((-1, config['image_size'], config['image_size']))
-
-num_train = int(dataset.shape[0] * (1 - config['test_dataset_percentage']))
-
-train_dataset = dataset[0:num_train]
-train_labels = labels[0:num_train]
-
-test_dataset = dataset[num_train:]
-test_labels = labels[num_train:]
-
-logger.info('Train Dataset: %s %s' % (train_dataset.shape, train_labels.shape))
-logger.info('Test Dataset: %s %s' % (test_dataset.shape, test_labels.shape))
-
-try:
-    with open(config['dataset_pickle_file'], 'wb') as f:
-        pickle_data = {
-            'train_dataset': train_dataset,
-            'train_labels': train_labels,
-            'test_dataset': test_dataset,
-            'test_labels': test_labels,
-        }
-        pickle.dump(pickle_data, f, pickle.HIGHEST_PROTOCOL)
-        logger.info('Created pickle: %s' % config['dataset_pickle_file'])
-except Exception as e:
-    logger.error('Error creating pickle: %s' % config['dataset_pickle_file'], e)
\ No newline at end of file
+# Only append the images that are not in the dataset yet
+incremental = '--incremental' in sys.argv[1:]
+
+# Folders with the images of each label, in label order
+if config['augmentation']['enabled']:
+    # Rotations and synthetic samples are made while training, so only the original images are stored
+    folders = [
+        [config['item']['original_folder']],
+        [config['relation']['original_folder']],
+        [config['user']['original_folder']],
+        [config['outlier']['original_folder'], config['backgrounds']['original_folder']],
+    ]
+else:
+    folders = [
+        [config['item']['folder']],
+        [config['relation']['folder']],
+        [config['user']['folder']],
+        [config['outlier']['folder']],
+    ]
+image_files = [[path for folder in label_folders for path in image_utils.list_model_images(folder)]
+               for label_folders in folders]
+
+writer = dataset_utils.DatasetWriter(config['dataset']['folder'], append=incremental)
+
+# Samples can't be removed from the dataset, so any changed or removed image needs a full rebuild.
+# A rebuild keeps the samples written by generate.py --format store
+current_files = set(path for files in image_files for path in files)
+for path, signature in writer.sources.items():
+    if path not in current_files or build_utils.file_signature(path) != signature:
+        logger.info('%s changed, rebuilding the whole dataset' % path)
+        writer = dataset_utils.DatasetWriter(config['dataset']['folder'])
+        break
+
+for label, files in enumerate(image_files):
+    new_files = [path for path in files if path not in writer.sources]
+    logger.info('Adding %d/%d images of %s' % (len(new_files), len(files), ', '.join(folders[label])))
+    images = image_utils.load_image_files(new_files)
+    writer.append(images, [label] * len(images), new_files)
+    del images
+
+train_dataset, test_dataset = dataset_utils.load_dataset(config['dataset']['folder'])
+logger.info('Train Dataset: %d images' % len(train_dataset))
+logger.info('Test Dataset: %d images' % len(test_dataset))
+logger.info('Created dataset: %s' % config['dataset']['folder'])
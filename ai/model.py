@@ -1,3 +1,4 @@
+import numpy as np
 import tensorflow as tf
 from model_config import model_config
 
@@ -32,20 +33,23 @@ class Model:
         self.image_fc_size = self.image_size // 4
         self.fc1_num_neurons = 1024
         self.fc2_num_neurons = 1024
+        self.dense_stride = self.image_size // self.image_fc_size
 
         self.train_data = None
         self.keep_prob = None
+        self.weights = None
 
-    def get_model(self):
+    def get_model(self, weight_values=None):
+        """Model to train and classify windows. With the trained weight values it is an inference graph, with the
+        weights as constants and without dropout"""
         self.train_data = tf.placeholder(tf.float32,
-                                         shape=[None, self.image_size, self.image_size, self.image_channels])
+                                         shape=[None, self.image_size, self.image_size, self.image_channels],
+                                         name='input')
+        weights = self._create_weights(weight_values)
 
         # Convolutional Layer 1
 
-        conv1_weights = weight(
-            [self.conv1_patch_size, self.conv1_patch_size, self.image_channels, self.conv1_num_channels])
-        conv1_biases = bias([self.conv1_num_channels])
-        conv1 = tf.nn.relu(conv2d(self.train_data, conv1_weights) + conv1_biases)
+        conv1 = tf.nn.relu(conv2d(self.train_data, weights['conv1_weights']) + weights['conv1_biases'])
 
         # Pooling Layer 1
 
@@ -53,10 +57,7 @@ class Model:
 
         # Convolutional Layer 2
 
-        conv2_weights = weight(
-            [self.conv2_patch_size, self.conv2_patch_size, self.conv1_num_channels, self.conv2_num_channels])
-        conv2_biases = bias([self.conv2_num_channels])
-        conv2 = tf.nn.relu(conv2d(pool1, conv2_weights) + conv2_biases)
+        conv2 = tf.nn.relu(conv2d(pool1, weights['conv2_weights']) + weights['conv2_biases'])
 
         # Pooling Layer 2
 
@@ -64,25 +65,133 @@ class Model:
 
         # Fully Connected Layer 1
 
-        fc1_weights = weight([pow(self.image_fc_size, 2) * self.conv2_num_channels, self.fc1_num_neurons])
-        fc1_biases = bias([self.fc1_num_neurons])
         pool2 = tf.reshape(pool2, [-1, pow(self.image_fc_size, 2) * self.conv2_num_channels])
-        fc1 = tf.nn.relu(tf.matmul(pool2, fc1_weights) + fc1_biases)
+        fc1 = tf.nn.relu(tf.matmul(pool2, weights['fc1_weights']) + weights['fc1_biases'])
 
         # Fully Connected Layer 2
 
-        fc2_weights = weight([self.fc1_num_neurons, self.fc2_num_neurons])
-        fc2_biases = bias([self.fc2_num_neurons])
-        fc2 = tf.nn.relu(tf.matmul(fc1, fc2_weights) + fc2_biases)
+        fc2 = tf.nn.relu(tf.matmul(fc1, weights['fc2_weights']) + weights['fc2_biases'])
 
         # Dropout
 
-        self.keep_prob = tf.placeholder(tf.float32)
-        fc1_drop = tf.nn.dropout(fc2, self.keep_prob)
+        fc1_drop = self._dropout(fc2, weight_values is None)
 
         # Readout Layer
 
-        layer4_weights = weight([self.fc2_num_neurons, self.num_labels])
-        layer4_biases = bias([self.num_labels])
+        return tf.nn.softmax(tf.matmul(fc1_drop, weights['layer4_weights']) + weights['layer4_biases'], name='output')
+
+    def get_dense_model(self, weight_values=None):
+        """Fully convolutional version of the model, it scores every window of an image of any size in one pass.
+        The output has the class probabilities of the window starting every dense_stride pixels."""
+        self.train_data = tf.placeholder(tf.float32, shape=[1, None, None, self.image_channels], name='input')
+        # Trained weights are reshaped into the kernels before they are frozen, variables are reshaped in the graph
+        kernel_shapes = self.dense_kernel_shapes()
+        weights = self._create_weights(weight_values, kernel_shapes if weight_values is not None else None)
+
+        # Convolutional Layer 1
+
+        conv1 = tf.nn.relu(conv2d(self.train_data, weights['conv1_weights']) + weights['conv1_biases'])
+
+        # Pooling Layer 1
+
+        pool1 = max_pool_2x2(conv1)
+
+        # Convolutional Layer 2
+
+        conv2 = tf.nn.relu(conv2d(pool1, weights['conv2_weights']) + weights['conv2_biases'])
+
+        # Pooling Layer 2
+
+        pool2 = max_pool_2x2(conv2)
+
+        # Fully Connected Layer 1 as a convolution over the whole pooled window
+
+        fc1_weights = self._kernel(weights['fc1_weights'], kernel_shapes['fc1_weights'])
+        fc1 = tf.nn.relu(tf.nn.conv2d(pool2, fc1_weights, strides=[1, 1, 1, 1], padding='VALID') +
+                         weights['fc1_biases'])
+
+        # Fully Connected Layer 2 as a 1x1 convolution
+
+        fc2_weights = self._kernel(weights['fc2_weights'], kernel_shapes['fc2_weights'])
+        fc2 = tf.nn.relu(conv2d(fc1, fc2_weights) + weights['fc2_biases'])
+
+        # Dropout
+
+        fc1_drop = self._dropout(fc2, weight_values is None)
+
+        # Readout Layer as a 1x1 convolution
+
+        layer4_weights = self._kernel(weights['layer4_weights'], kernel_shapes['layer4_weights'])
+        readout = conv2d(fc1_drop, layer4_weights) + weights['layer4_biases']
 
-        return tf.nn.softmax(tf.matmul(fc1_drop, layer4_weights) + layer4_biases)
+        softmax = tf.nn.softmax(tf.reshape(readout, [-1, self.num_labels]))
+        return tf.reshape(softmax, tf.shape(readout), name='output')
+
+    def import_graph(self, graph_def):
+        """Load an exported inference graph in the default graph, returns its output"""
+        self.train_data, output = tf.import_graph_def(graph_def, return_elements=['input:0', 'output:0'], name='')
+        self.keep_prob = None
+        self.weights = None
+        return output
+
+    def feed_dict(self, data, keep_prob=1.0):
+        """Feed of the model input, with the dropout keep probability when the graph has dropout"""
+        feed_dict = {self.train_data: data}
+        if self.keep_prob is not None:
+            feed_dict[self.keep_prob] = keep_prob
+        return feed_dict
+
+    def weight_shapes(self):
+        """Name and shape of each weight, in the order they are created"""
+        return [
+            ('conv1_weights', [self.conv1_patch_size, self.conv1_patch_size, self.image_channels,
+                               self.conv1_num_channels]),
+            ('conv1_biases', [self.conv1_num_channels]),
+            ('conv2_weights', [self.conv2_patch_size, self.conv2_patch_size, self.conv1_num_channels,
+                               self.conv2_num_channels]),
+            ('conv2_biases', [self.conv2_num_channels]),
+            ('fc1_weights', [pow(self.image_fc_size, 2) * self.conv2_num_channels, self.fc1_num_neurons]),
+            ('fc1_biases', [self.fc1_num_neurons]),
+            ('fc2_weights', [self.fc1_num_neurons, self.fc2_num_neurons]),
+            ('fc2_biases', [self.fc2_num_neurons]),
+            ('layer4_weights', [self.fc2_num_neurons, self.num_labels]),
+            ('layer4_biases', [self.num_labels])
+        ]
+
+    def dense_kernel_shapes(self):
+        """Shape of the fully connected weights as the convolution kernels of the dense model"""
+        return {
+            'fc1_weights': [self.image_fc_size, self.image_fc_size, self.conv2_num_channels, self.fc1_num_neurons],
+            'fc2_weights': [1, 1, self.fc1_num_neurons, self.fc2_num_neurons],
+            'layer4_weights': [1, 1, self.fc2_num_neurons, self.num_labels]
+        }
+
+    @staticmethod
+    def _kernel(weights, shape):
+        """Weights with the shape of a kernel, reshaped in the graph only when they are not already"""
+        if weights.get_shape().as_list() == shape:
+            return weights
+        return tf.reshape(weights, shape)
+
+    def _dropout(self, layer, training):
+        """Dropout with a fed keep probability, inference graphs have none"""
+        if not training:
+            self.keep_prob = None
+            return layer
+        self.keep_prob = tf.placeholder(tf.float32)
+        return tf.nn.dropout(layer, self.keep_prob)
+
+    def _create_weights(self, values=None, shapes=None):
+        """Create the model variables, always in the same order so they match the names in the checkpoint.
+        With trained values, the weights are constants instead of variables, reshaped to the given shapes"""
+        weights = {}
+        for name, shape in self.weight_shapes():
+            if values is not None:
+                shape = (shapes or {}).get(name, shape)
+                weights[name] = tf.constant(np.reshape(values[name], shape), dtype=tf.float32, shape=shape, name=name)
+            elif name.endswith('_biases'):
+                weights[name] = bias(shape)
+            else:
+                weights[name] = weight(shape)
+        self.weights = weights
+        return weights
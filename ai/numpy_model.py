@@ -0,0 +1,110 @@
+import numpy as np
+from model_config import model_config
+from utils.logger import Logger
+
+logger = Logger('numpy_model')
+
+
+def im2col(images, patch_size):
+    """Patches of every pixel of a batch of images with SAME padding, one row per pixel.
+    Each row has the patch_size x patch_size x channels values in the order of the convolution weights"""
+    n, height, width, channels = images.shape
+    pad = patch_size // 2
+    padded = np.pad(images, ((0, 0), (pad, pad), (pad, pad), (0, 0)), mode='constant')
+    strides = padded.strides
+    patches = np.lib.stride_tricks.as_strided(
+        padded, shape=(n, height, width, patch_size, patch_size, channels),
+        strides=(strides[0], strides[1], strides[2], strides[1], strides[2], strides[3]), writeable=False)
+    return patches.reshape((n * height * width, patch_size * patch_size * channels))
+
+
+def conv2d_relu(images, weights, biases):
+    """Convolution with stride 1 and SAME padding followed by a ReLU"""
+    n, height, width, _ = images.shape
+    patch_size = weights.shape[0]
+    result = np.dot(im2col(images, patch_size), weights.reshape((-1, weights.shape[3])))
+    result += biases
+    np.maximum(result, 0, out=result)
+    return result.reshape((n, height, width, weights.shape[3]))
+
+
+def max_pool_2x2(images):
+    """2x2 max pooling with stride 2, the sizes of the model layers are always even"""
+    n, height, width, channels = images.shape
+    return images.reshape((n, height // 2, 2, width // 2, 2, channels)).max(axis=(2, 4))
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class NumpyModel:
+    """Forward pass of the model in NumPy, from the exported weights.
+    It classifies the windows without TensorFlow, so a process does not pay its import time and memory."""
+
+    def __init__(self, weight_values, batch_size=64):
+        self.weights = {name: np.asarray(value, dtype=np.float32) for name, value in weight_values.items()}
+        self.image_size = model_config.get('image_size')
+        # The patches of a batch take batch_size x 14 x 14 x 800 floats in the second convolution
+        self.batch_size = batch_size
+        self.model_file = None
+
+    @staticmethod
+    def load(weights_file):
+        """Load the weights of a numpy file, quantized weights run with a QuantizedNumpyModel"""
+        with np.load(weights_file) as values:
+            values = {name: values[name] for name in values.files}
+        if 'quantization' in values:
+            model = QuantizedNumpyModel(values)
+        else:
+            model = NumpyModel(values)
+        model.model_file = weights_file
+        logger.info("Model restored from %s." % weights_file)
+        return model
+
+    def predict(self, images):
+        """Class probabilities of a batch of images"""
+        images = np.asarray(images, dtype=np.float32)
+        images = images.reshape((len(images), self.image_size, self.image_size, -1))
+        results = [self._forward(images[offset:offset + self.batch_size])
+                   for offset in range(0, len(images), self.batch_size)]
+        if not results:
+            return np.zeros((0, self.weights['layer4_biases'].shape[0]), dtype=np.float32)
+        return np.concatenate(results)
+
+    def close(self):
+        pass
+
+    def _forward(self, images):
+        fc1 = np.maximum(self._dense('fc1', self._features(images)), 0)
+        fc2 = np.maximum(self._dense('fc2', fc1), 0)
+        return softmax(self._dense('layer4', fc2))
+
+    def _features(self, images):
+        """Output of the convolutional layers, flattened to be the input of the first fully connected layer"""
+        w = self.weights
+        pool1 = max_pool_2x2(conv2d_relu(images, w['conv1_weights'], w['conv1_biases']))
+        pool2 = max_pool_2x2(conv2d_relu(pool1, w['conv2_weights'], w['conv2_biases']))
+        return pool2.reshape((len(images), -1))
+
+    def _dense(self, layer, inputs):
+        return np.dot(inputs, self.weights[layer + '_weights']) + self.weights[layer + '_biases']
+
+
+class QuantizedNumpyModel(NumpyModel):
+    """NumpyModel from a weights file with the fully connected layers quantized by quantize.py.
+    The quantization only makes the file smaller: the weights are expanded to float32 when they are loaded, so the
+    model runs with the speed and memory of the float32 one and the accuracy of the quantized weights.
+    NumPy multiplies int8 and float16 matrices without BLAS, hundreds of times slower than float32."""
+
+    def __init__(self, values):
+        self.quantization = str(values['quantization'])
+        self.quantized_layers = [str(layer) for layer in values['quantized_layers']]
+        weight_values = {name: value for name, value in values.items()
+                         if name not in ('quantization', 'quantized_layers') and not name.endswith('_scale')}
+        if self.quantization == 'int8':
+            for layer in self.quantized_layers:
+                weight_values[layer + '_weights'] = (values[layer + '_weights'].astype(np.float32) *
+                                                     values[layer + '_weights_scale'].astype(np.float32))
+        NumpyModel.__init__(self, weight_values)
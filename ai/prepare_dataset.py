@@ -1,69 +1,81 @@
+import os
+import sys
 from scipy import misc
 from config import config
 from utils import image_utils
 from utils import data_utils
+from utils.build_utils import BuildManifest
 from utils.logger import Logger
 
 logger = Logger('prepare_dataset')
 
-# Load dataset
-items_dataset = image_utils.load_model_images(config['item']['original_folder'])
-items_generated = image_utils.load_model_images(config['item']['generated_folder'])
-relations_dataset = image_utils.load_model_images(config['relation']['original_folder'])
-relations_generated = image_utils.load_model_images(config['relation']['generated_folder'])
-users_dataset = image_utils.load_model_images(config['user']['original_folder'])
-backgrounds_dataset = image_utils.load_model_images(config['backgrounds']['original_folder'])
-outliers_dataset = image_utils.load_model_images(config['outlier']['original_folder'])
+# Only regenerate the images whose source or parameters changed
+incremental = '--incremental' in sys.argv[1:]
 
-# Rotate items 90, 180 and 270 degrees
-generated_images = image_utils.rotate_images(items_dataset)
-items_dataset = items_dataset + generated_images
+# Source folders of each dataset folder, with the rotations of their images
+datasets = [
+    (config['item']['folder'], [
+        # Rotate items 90, 180 and 270 degrees
+        (config['item']['original_folder'], [0, 1, 2, 3]),
+        # Add generated items
+        (config['item']['generated_folder'], [0]),
+    ]),
+    (config['relation']['folder'], [
+        # Rotate relations 180 degrees
+        (config['relation']['original_folder'], [0, 2]),
+        # Add generated relations
+        (config['relation']['generated_folder'], [0]),
+    ]),
+    (config['user']['folder'], [
+        (config['user']['original_folder'], [0]),
+    ]),
+    (config['outlier']['folder'], [
+        # Rotate outliers 90, 180 and 270 degrees
+        (config['outlier']['original_folder'], [0, 1, 2, 3]),
+        # Group outliers and backgrounds
+        (config['backgrounds']['original_folder'], [0]),
+    ]),
+]
 
-# Add generated items
-items_dataset = items_dataset + items_generated
 
-# Rotate relations 180 degrees
-generated_images = image_utils.rotate_images(relations_dataset, rotations=[2])
-relations_dataset = relations_dataset + generated_images
+def output_name(source_folder, image_file, rotation):
+    name = os.path.splitext(os.path.basename(image_file))[0]
+    return '%s_%s_%d.jpg' % (os.path.basename(source_folder), name, rotation)
 
-# Add generated relations
-relations_dataset = relations_dataset + relations_generated
 
-# Rotate outliers 90, 180 and 270 degrees
-generated_images = image_utils.rotate_images(outliers_dataset)
-outliers_dataset = outliers_dataset + generated_images
+def prepare_folder(folder, sources):
+    if not incremental:
+        data_utils.clean_directory(folder)
+    elif not os.path.exists(folder):
+        os.makedirs(folder)
 
-# Group outliers and backgrounds
-outliers_dataset = outliers_dataset + backgrounds_dataset
+    manifest = BuildManifest(folder)
+    params = {'image_size': config['image_size']}
+    outputs = []
+    for source_folder, rotations in sources:
+        # Find the images with outputs to regenerate
+        changed_files = []
+        image_files = image_utils.list_model_images(source_folder)
+        for image_file in image_files:
+            names = [output_name(source_folder, image_file, rotation) for rotation in rotations]
+            outputs += names
+            if not all(manifest.is_fresh(name, params) for name in names):
+                changed_files.append(image_file)
+        logger.info('%d/%d images changed in %s' % (len(changed_files), len(image_files), source_folder))
 
-# Save items
-data_utils.clean_directory(config['item']['folder'])
-for i in range(len(items_dataset)):
-    path = config['item']['folder'] + '/' + str(i) + '.jpg'
-    logger.info('creating %s' % path)
-    image = image_utils.clean_shape(items_dataset[i])
-    misc.imsave(path, image)
+        images = image_utils.load_image_files(changed_files)
+        rotated_images = image_utils.rotate_images(images, rotations=rotations)
+        for i, rotated_image in enumerate(rotated_images):
+            image_file = changed_files[i // len(rotations)]
+            name = output_name(source_folder, image_file, rotations[i % len(rotations)])
+            path = os.path.join(folder, name)
+            logger.info('creating %s' % path)
+            misc.imsave(path, image_utils.clean_shape(rotated_image))
+            manifest.record(name, [image_file], params)
 
-# Save relations
-data_utils.clean_directory(config['relation']['folder'])
-for i in range(len(relations_dataset)):
-    path = config['relation']['folder'] + '/' + str(i) + '.jpg'
-    logger.info('creating %s' % path)
-    image = image_utils.clean_shape(relations_dataset[i])
-    misc.imsave(path, image)
+    manifest.remove_stale(outputs)
+    manifest.save()
 
-# Save users
-data_utils.clean_directory(config['user']['folder'])
-for i in range(len(users_dataset)):
-    path = config['user']['folder'] + '/' + str(i) + '.jpg'
-    logger.info('creating %s' % path)
-    image = image_utils.clean_shape(users_dataset[i])
-    misc.imsave(path, image)
 
-# Save outliers
-data_utils.clean_directory(config['outlier']['folder'])
-for i in range(len(outliers_dataset)):
-    path = config['outlier']['folder'] + '/' + str(i) + '.jpg'
-    logger.info('creating %s' % path)
-    image = image_utils.clean_shape(outliers_dataset[i])
-    misc.imsave(path, image)
+for folder, sources in datasets:
+    prepare_folder(folder, sources)
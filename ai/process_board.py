@@ -1,46 +1,127 @@
 #!/usr/bin/python
 
-import tensorflow as tf
 import sys, getopt
+import glob
+import os
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 from scipy import misc
-from model import Model
 from model_config import model_config
+from numpy_model import NumpyModel
 from utils import data_utils
 from utils import image_utils
+from utils import cache_utils
+from utils import profile_utils
 from utils.logger import Logger
 
 logger = Logger('process_board')
 
+image_extensions = ['.jpg', '.jpeg', '.png']
 
-def process_board(image_file, lang, free_mode):
-    graph = tf.Graph()
+# Config values that change the result of a board
+result_config_keys = ['image_size', 'match_min_confidence', 'match_max_shared_zone', 'dense_scoring', 'cascade']
 
-    with graph.as_default():
-        model = Model()
-        y_conv = model.get_model()
 
-        # Add an op to initialize the variables.
-        init_op = tf.initialize_all_variables()
+class BoardDetection:
+    """State of a board between locating its elements and reading their text"""
 
-        # Add ops to save and restore all the variables.
-        saver = tf.train.Saver()
+    def __init__(self, image_file, lang, free_mode):
+        self.image_file = image_file
+        self.lang = lang
+        self.free_mode = free_mode
+        self.start_time = time.time()
+        self.timings = {}
+        self.cache_key = None
+        self.profile = profile_utils.Profile() if model_config.get('profiling')['enabled'] else None
+        self.data = None
+        self.pyramid = None
+        self.relations = []
+        self.items = []
+        self.users = []
 
-    with tf.Session(graph=graph) as sess:
-        sess.run(init_op)
 
-        saver.restore(sess, model_config.get('model_file'))
-        logger.info("Model restored.")
+class BoardProcessor:
+    """Keeps the model loaded to process many boards"""
 
-        start_time = time.time()
+    def __init__(self, use_cache=False, backend=None, profile_in_response=False):
+        self.profile_in_response = profile_in_response or model_config.get('profiling')['in_response']
+        self.result_cache = None
+        if use_cache or model_config.get('result_cache')['enabled']:
+            cache_config = model_config.get('result_cache')
+            self.result_cache = cache_utils.DiskCache(cache_config['folder'], cache_config['max_size'])
+
+        self.predictor = self._create_predictor(backend or model_config.get('inference_model')['backend'])
+        if self.result_cache is not None:
+            self.model_digest = cache_utils.model_digest(self.predictor.model_file)
+
+    def process(self, image_file, lang, free_mode):
+        """Extract the elements of a board, returns the response data and the time spent in each stage"""
+        return self.read_elements(self.detect(image_file, lang, free_mode))
+
+    def process_batch(self, image_files, lang, free_mode):
+        """Process many boards, reading the text of a board while the elements of the next one are located.
+        Yields the image file, the response data and the timings of each board, in order."""
+        executor = ThreadPoolExecutor(max_workers=1)
+        pending = None
+        try:
+            for image_file in image_files:
+                try:
+                    result = executor.submit(self.read_elements, self.detect(image_file, lang, free_mode))
+                except Exception as e:
+                    result = e
+                if pending is not None:
+                    yield _batch_result(*pending)
+                pending = (image_file, result)
+            if pending is not None:
+                yield _batch_result(*pending)
+        finally:
+            executor.shutdown()
+
+    def detect(self, image_file, lang, free_mode):
+        """Locate the elements of a board, the first stage of process"""
+        detection = BoardDetection(image_file, lang, free_mode)
+        with profile_utils.activate(detection.profile):
+            self._detect(detection)
+        return detection
+
+    def read_elements(self, detection):
+        """Read the text of the located elements and prepare the response data, the last stage of process"""
+        with profile_utils.activate(detection.profile):
+            data, timings = self._read_elements(detection)
+
+        if detection.profile is not None:
+            profile = detection.profile.to_dict()
+            logger.info('Profile %s' % json.dumps({'image': detection.image_file, 'profile': profile}))
+            if self.profile_in_response:
+                data = dict(data, profile=profile)
+        return data, timings
+
+    def _detect(self, detection):
+        image_file = detection.image_file
+
+        if self.result_cache is not None:
+            detection.cache_key = self._cache_key(image_file, detection.lang, detection.free_mode)
+            detection.data = self.result_cache.get(detection.cache_key)
+            if detection.data is not None:
+                profile_utils.count('result_cache.hits')
+                logger.info('Board found in cache')
+                return
+
+        stage_time = time.time()
+        with profile_utils.timer('decode'):
+            image = image_utils.read_image_gray(image_file)
+        detection.pyramid = image_utils.ImagePyramid(image)
+        detection.timings['read'] = time.time() - stage_time
 
-        image_data, image = image_utils.read_image(image_file)
-        relations, items, users = data_utils.locate_labels(image_data, model, y_conv, sess)
+        stage_time = time.time()
+        detection.relations, detection.items, detection.users = data_utils.locate_labels(detection.pyramid,
+                                                                                         self.predictor)
+        detection.timings['locate'] = time.time() - stage_time
 
         # data_utils.clean_directory('./tmp')
         # i = 0
-        # for elem in relations:
+        # for elem in detection.relations:
         #     tmp_image = color_image[elem['zone'][0]:elem['zone'][1], elem['zone'][2]:elem['zone'][3]]
         #     tmp_image = image_utils.clean_shape(tmp_image)
         #     path = 'tmp/relation_' + str(i) + '.jpg'
@@ -49,7 +130,7 @@ def process_board(image_file, lang, free_mode):
         #     misc.imsave(path, tmp_image)
         #
         # i = 0
-        # for elem in items:
+        # for elem in detection.items:
         #     tmp_image = color_image[elem['zone'][0]:elem['zone'][1], elem['zone'][2]:elem['zone'][3]]
         #     tmp_image = image_utils.clean_shape(tmp_image)
         #     path = 'tmp/item_' + str(i) + '.jpg'
@@ -58,36 +139,176 @@ def process_board(image_file, lang, free_mode):
         #     misc.imsave(path, tmp_image)
 
         # Creates an image showing the matches
-        # tmp_image = image_utils.clean_shape(image_data)
-        # for match in (relations + items + users):
+        # tmp_image = image_utils.clean_shape(image_utils.normalize_image(detection.pyramid.image))
+        # for match in (detection.relations + detection.items + detection.users):
         #     tmp_image = image_utils.draw_border(tmp_image, match['zone'][0], match['zone'][2], match['zone'][1], match['zone'][3])
         # path = 'dataset/results.jpg'
         # logger.debug('Saving results image on %s' % path)
         # misc.imsave(path, tmp_image)
 
-        relations, items = data_utils.read_text(image, relations, items, lang=lang)
+    def _read_elements(self, detection):
+        timings = detection.timings
+        if detection.data is not None:
+            timings['total'] = time.time() - detection.start_time
+            return detection.data, timings
+
+        relations, items, users = detection.relations, detection.items, detection.users
+
+        stage_time = time.time()
+        with profile_utils.timer('ocr'):
+            relations, items = data_utils.read_text(detection.pyramid.image, relations, items, lang=detection.lang)
+        timings['ocr'] = time.time() - stage_time
+
+        stage_time = time.time()
         relations, items = data_utils.find_element_centers(relations, items)
 
-        if not free_mode:
+        if not detection.free_mode:
             relations = data_utils.find_relation_types(relations)
             relations, items = data_utils.group_by_relation(relations, items)
             relations,items = data_utils.sort_by_position(relations, items)
             data_utils.prepare_response_data(relations, items, users)
+        timings['post'] = time.time() - stage_time
+        timings['total'] = time.time() - detection.start_time
+
+        logger.info('Found %d items and %d relations' % (len(items), len(relations)))
+        logger.info("Prediction Time: %s seconds" % timings['total'])
 
-        # Print the JSON response
-        print(json.dumps({
+        data = {
             'items': items,
             'relations': relations
-        }))
+        }
+        if detection.cache_key is not None:
+            self.result_cache.put(detection.cache_key, data)
+        return data, timings
 
-        logger.info('Found %d items and %d relations' % (len(items), len(relations)))
-        logger.info("Prediction Time: %s seconds" % (time.time() - start_time))
+    def _create_predictor(self, backend):
+        """Model used to classify the windows, run with the backend"""
+        inference_config = model_config.get('inference_model')
+        dense = model_config.get('dense_scoring')
+        if backend == 'numpy':
+            if dense:
+                raise ValueError('The numpy backend does not support dense scoring')
+            if inference_config['quantization']:
+                return NumpyModel.load(inference_config['quantized_weights_file'])
+            return NumpyModel.load(inference_config['weights_file'])
+        if backend == 'tensorflow':
+            # Imported only when it is used, it takes seconds and hundreds of MB
+            from tf_predictor import TensorFlowPredictor
+            return TensorFlowPredictor(inference_config['format'], dense)
+        raise ValueError('Unknown inference backend: %s' % backend)
+
+    def _cache_key(self, image_file, lang, free_mode):
+        """Key of the result of a board, changes with the image content, the model or the settings"""
+        config_values = [model_config.get(key) for key in result_config_keys]
+        return cache_utils.make_key(cache_utils.file_digest(image_file), self.model_digest, lang, free_mode,
+                                    config_values)
+
+    def close(self):
+        self.predictor.close()
+
+
+def _batch_result(image_file, result):
+    """Response data and timings of a board of a batch, from the future reading its text or the error locating it"""
+    try:
+        if isinstance(result, Exception):
+            raise result
+        data, timings = result.result()
+        return image_file, data, timings
+    except Exception as e:
+        logger.error('Error processing board %s: %s' % (image_file, e))
+        return image_file, {'error': str(e)}, {}
+
+
+def list_images(source):
+    """Image files of a directory, a glob pattern or a manifest with one image per line ('-' reads it from stdin)"""
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source)
+                      if os.path.splitext(name)[1].lower() in image_extensions)
+    if glob.has_magic(source):
+        return sorted(glob.glob(source))
+    if os.path.splitext(source)[1].lower() in image_extensions:
+        return [source]
+
+    if source == '-':
+        lines = sys.stdin.read().splitlines()
+        folder = ''
+    else:
+        with open(source) as f:
+            lines = f.read().splitlines()
+        # Paths in a manifest are relative to its folder
+        folder = os.path.dirname(source)
+    return [os.path.join(folder, line.strip()) for line in lines if line.strip() and not line.startswith('#')]
+
+
+def process_batch(source, lang, free_mode, use_cache=False, backend=None, output_file=None, profile=False):
+    """Process all the images of a source with one loaded model, writing one JSON line per image"""
+    image_files = list_images(source)
+    logger.info('Processing %d boards' % len(image_files))
+    processor = BoardProcessor(use_cache, backend, profile)
+    output = open(output_file, 'w') if output_file else sys.stdout
+
+    start_time = time.time()
+    try:
+        for image_file, data, timings in processor.process_batch(image_files, lang, free_mode):
+            data['image'] = image_file
+            data['timings'] = timings
+            output.write(json.dumps(data) + '\n')
+            output.flush()
+    finally:
+        processor.close()
+        if output is not sys.stdout:
+            output.close()
+    logger.info('Processed %d boards in %s seconds' % (len(image_files), time.time() - start_time))
+
+
+def process_board(image_file, lang, free_mode, use_cache=False, backend=None, profile=False):
+    processor = BoardProcessor(use_cache, backend, profile)
+    data, timings = processor.process(image_file, lang, free_mode)
+    processor.close()
+
+    # Print the JSON response
+    print(json.dumps(data))
+
+
+def serve(lang, free_mode, use_cache=False, backend=None, profile=False):
+    """Process the boards requested on stdin, one JSON object per line like {"image": ..., "lang": ..., "free": ...}.
+    Writes one JSON response per line, with the same data as a single run plus the timings of the request."""
+    processor = BoardProcessor(use_cache, backend, profile)
+    logger.info('Waiting for boards')
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        start_time = time.time()
+        request = {}
+        try:
+            request = json.loads(line)
+            data, timings = processor.process(request['image'], request.get('lang', lang),
+                                              request.get('free', free_mode))
+        except Exception as e:
+            logger.error('Error processing board %s: %s' % (request.get('image'), e))
+            data, timings = {'error': str(e)}, {}
+        timings['request'] = time.time() - start_time
+        data['timings'] = timings
+        if 'id' in request:
+            data['id'] = request['id']
+
+        sys.stdout.write(json.dumps(data) + '\n')
+        sys.stdout.flush()
+
+    processor.close()
 
 
 def main(argv):
-    help_text = 'Usage: process_board.py -i <image>'
+    help_text = 'Usage: process_board.py -i <image> [--cache] [--backend <tensorflow|numpy>] [--profile]\n' \
+                '       process_board.py --batch <directory|glob|manifest|-> [--output <file>] [--cache] ' \
+                '[--backend <tensorflow|numpy>] [--profile]\n' \
+                '       process_board.py --serve [--cache] [--backend <tensorflow|numpy>] [--profile]'
     try:
-        opts, args = getopt.getopt(argv, "hi:l:g:f", ['help', 'image=', 'lang=', 'log=', 'free'])
+        opts, args = getopt.getopt(argv, "hi:l:g:fscb:d:o:", ['help', 'image=', 'lang=', 'log=', 'free', 'serve',
+                                                            'cache', 'backend=', 'batch=', 'output=', 'profile'])
     except getopt.GetoptError:
         print(help_text)
         sys.exit(2)
@@ -96,6 +317,12 @@ def main(argv):
     lang = None
     log_level = None
     free_mode = False
+    serve_mode = False
+    use_cache = False
+    backend = None
+    batch = None
+    output_file = None
+    profile = False
     for o, a in opts:
         if o in ("-h", "--help"):
             print(help_text)
@@ -108,15 +335,32 @@ def main(argv):
             log_level = a
         elif o in ("-f", "--free"):
             free_mode = True
+        elif o in ("-s", "--serve"):
+            serve_mode = True
+        elif o in ("-c", "--cache"):
+            use_cache = True
+        elif o in ("-b", "--backend"):
+            backend = a
+        elif o in ("-d", "--batch"):
+            batch = a
+        elif o in ("-o", "--output"):
+            output_file = a
+        elif o == "--profile":
+            profile = True
 
-    if image is None:
+    if image is None and batch is None and not serve_mode:
         print(help_text)
         sys.exit(2)
 
     if not log_level is None:
         Logger.set_level(log_level)
 
-    process_board(image, lang, free_mode)
+    if serve_mode:
+        serve(lang, free_mode, use_cache, backend, profile)
+    elif batch is not None:
+        process_batch(batch, lang, free_mode, use_cache, backend, output_file, profile)
+    else:
+        process_board(image, lang, free_mode, use_cache, backend, profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,43 @@
+import getopt
+import sys
+from config import config
+from numpy_model import NumpyModel
+from utils import dataset_utils
+from utils import quantize_utils
+from utils.logger import Logger
+
+logger = Logger('quantize')
+
+
+def main(argv):
+    help_text = 'Usage: quantize.py [--quantization <int8|float16>] [--output <file>]'
+    try:
+        opts, args = getopt.getopt(argv, "hq:o:", ['help', 'quantization=', 'output='])
+    except getopt.GetoptError:
+        print(help_text)
+        sys.exit(2)
+
+    inference_config = config['inference_model']
+    quantization = inference_config['quantization'] or 'int8'
+    output_file = inference_config['quantized_weights_file']
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print(help_text)
+            sys.exit()
+        elif o in ("-q", "--quantization"):
+            quantization = a
+        elif o in ("-o", "--output"):
+            output_file = a
+
+    weight_values = NumpyModel.load(inference_config['weights_file']).weights
+    quantized_values = quantize_utils.quantize_weights(weight_values, quantization)
+    quantize_utils.save_quantized_weights(quantized_values, output_file)
+
+    train_dataset, test_dataset = dataset_utils.load_dataset(config['dataset']['folder'])
+    float_accuracy, quantized_accuracy = quantize_utils.compare_accuracy(weight_values, quantized_values, test_dataset)
+    logger.info("test accuracy float32 %g, %s %g (%+g)" %
+                (float_accuracy, quantization, quantized_accuracy, quantized_accuracy - float_accuracy))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,263 @@
+import getopt
+import json
+import os.path
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from scipy import misc
+from config import config
+from numpy_model import NumpyModel
+from process_board import BoardProcessor, list_images
+from utils import cache_utils
+from utils import image_utils
+from utils import ocr_utils
+from utils import quantize_utils
+from utils.logger import Logger
+
+# Throughput and latency of the board pipeline over the corpus of boards and synthetic boards.
+# Run it from the ai folder: python3 tests/board_benchmark.py [--save-baseline]
+# Without --save-baseline it compares the results with the baseline and exits with an error on a regression.
+# With --quantization it also compares the numpy backend with the float32 and the quantized weights.
+
+stages = ['read', 'locate', 'ocr', 'post', 'total']
+default_baseline = os.path.join(os.path.dirname(__file__), 'board_benchmark_baseline.json')
+
+
+def synthetic_boards(folder, count, seed=0):
+    """Boards with columns of relations and items, written in a folder.
+    The items and relations are pasted from the original objects when they exist, otherwise they are drawn,
+    so the benchmark doesn't depend on the private dataset. The same seed always builds the same boards."""
+    random = np.random.RandomState(seed)
+    objects = {}
+    for label in ['relation', 'item']:
+        objects_folder = config[label]['objects_folder']
+        if os.path.isdir(objects_folder):
+            objects[label] = image_utils.load_original_images(objects_folder)[0]
+
+    files = []
+    for i in range(count):
+        height, width = random.randint(900, 1400), random.randint(1200, 2000)
+        board = np.clip(random.normal(235, 8, (height, width)), 0, 255)
+        columns = random.randint(3, 6)
+        column_width = width // columns
+        for column in range(columns):
+            x = column * column_width + column_width // 10
+            y = height // 20
+            label = 'relation'
+            while True:
+                size = (column_width // 4, column_width * 8 // 10) if label == 'relation' else \
+                    (column_width * 6 // 10, column_width * 6 // 10)
+                if y + size[0] >= height:
+                    break
+                board[y:y + size[0], x:x + size[1]] = _board_object(objects.get(label), size, random)
+                y += size[0] + height // 30
+                label = 'item'
+        path = os.path.join(folder, 'synthetic_%d.png' % i)
+        misc.imsave(path, board.astype(np.uint8))
+        files.append(path)
+    return files
+
+
+def _board_object(object_images, size, random):
+    """An original object resized to the size, or a box with lines like text when there are none"""
+    if object_images:
+        image = object_images[random.randint(len(object_images))]
+        return image_utils.clean_shape(image_utils.resize_image(image, size[0], size[1]))
+    box = np.full(size, random.randint(150, 230), dtype=float)
+    box[:2, :] = box[-2:, :] = box[:, :2] = box[:, -2:] = 40
+    for line in range(size[0] // 5, size[0] * 4 // 5, 12):
+        line_width = random.randint(size[1] // 3, size[1] * 4 // 5)
+        box[line:line + 4, size[1] // 10:size[1] // 10 + line_width] = 30
+    return box
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.
+
+
+def run_benchmark(image_files, repeat, lang, backend):
+    """Process the boards repeat times with one processor, returns the report of the runs"""
+    processor = BoardProcessor(use_cache=False, backend=backend, profile_in_response=True)
+
+    # The first board loads the lazy parts of the pipeline, like the OCR pool
+    processor.process(image_files[0], lang, False)
+
+    stage_times = {stage: [] for stage in stages}
+    counters = {}
+    errors = 0
+    start_time = time.time()
+    for i in range(repeat):
+        # Every run reads the text again instead of taking it from the previous one
+        ocr_utils.text_cache = cache_utils.MemoryCache(config['ocr_cache']['max_entries'])
+        for image_file, data, timings in processor.process_batch(image_files, lang, False):
+            if 'error' in data:
+                errors += 1
+                continue
+            for stage in stages:
+                stage_times[stage].append(timings.get(stage, 0.))
+            for name, value in data.get('profile', {}).get('counters', {}).items():
+                counters[name] = counters.get(name, 0) + value
+    elapsed = time.time() - start_time
+    processor.close()
+
+    boards = len(image_files) * repeat
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'boards': boards,
+        'errors': errors,
+        'seconds': elapsed,
+        'boards_per_sec': boards / elapsed if elapsed > 0 else 0.,
+        # ru_maxrss is in KB on Linux
+        'peak_rss_mb': usage.ru_maxrss / 1024.,
+        'peak_children_rss_mb': children_usage.ru_maxrss / 1024.,
+        'stages': {stage: {'p50': percentile(times, 50), 'p95': percentile(times, 95)}
+                   for stage, times in stage_times.items()},
+        'counters': counters
+    }
+
+
+def compare_quantization(image_files, repeat, lang, quantization, folder):
+    """Throughput, latency and weights file size of the numpy backend with float32 and quantized weights"""
+    inference_config = config['inference_model']
+    weights_file = inference_config['weights_file']
+    quantized_file = os.path.join(folder, 'quantized_weights.npz')
+    quantize_utils.save_quantized_weights(
+        quantize_utils.quantize_weights(NumpyModel.load(weights_file).weights, quantization), quantized_file)
+
+    reports = {}
+    previous = inference_config['quantization'], inference_config['quantized_weights_file']
+    try:
+        for name, weights_quantization in [('float32', None), (quantization, quantization)]:
+            inference_config['quantization'] = weights_quantization
+            inference_config['quantized_weights_file'] = quantized_file
+            reports[name] = run_benchmark(image_files, repeat, lang, 'numpy')
+    finally:
+        inference_config['quantization'], inference_config['quantized_weights_file'] = previous
+
+    return {
+        name: {
+            'boards_per_sec': report['boards_per_sec'],
+            'locate.p50': report['stages']['locate']['p50'],
+            'total.p50': report['stages']['total']['p50'],
+            'weights_file_mb': os.path.getsize(weights_file if name == 'float32' else quantized_file) / 1024. / 1024.
+        } for name, report in reports.items()
+    }
+
+
+def find_regressions(report, baseline, tolerance, min_seconds=0.005):
+    """Measures worse than the baseline by more than the tolerance, as a relative change.
+    Latencies within min_seconds of the baseline are noise of the short stages, not regressions."""
+    regressions = []
+
+    def check(name, value, base_value, higher_is_better=False, min_difference=0.):
+        if not base_value or abs(value - base_value) <= min_difference:
+            return
+        change = (value - base_value) / base_value
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append({'measure': name, 'baseline': base_value, 'value': value, 'change': change})
+
+    check('boards_per_sec', report['boards_per_sec'], baseline['boards_per_sec'], higher_is_better=True)
+    check('peak_rss_mb', report['peak_rss_mb'], baseline['peak_rss_mb'])
+    for stage in stages:
+        for q in ['p50', 'p95']:
+            check('%s.%s' % (stage, q), report['stages'][stage][q], baseline['stages'][stage][q],
+                  min_difference=min_seconds)
+    return regressions
+
+
+def main(argv):
+    help_text = 'Usage: board_benchmark.py [--corpus <directory|glob|manifest>] [--synthetic <count>] ' \
+                '[--repeat <times>] [--backend <tensorflow|numpy>] [--baseline <file>] [--save-baseline] ' \
+                '[--tolerance <fraction>] [--quantization <int8|float16>]'
+    try:
+        opts, args = getopt.getopt(argv, "hc:s:r:b:", ['help', 'corpus=', 'synthetic=', 'repeat=', 'backend=',
+                                                      'baseline=', 'save-baseline', 'tolerance=', 'lang=',
+                                                      'quantization='])
+    except getopt.GetoptError:
+        print(help_text)
+        sys.exit(2)
+
+    corpus = './dataset/boards'
+    synthetic = 10
+    repeat = 3
+    backend = None
+    baseline_file = default_baseline
+    save_baseline = False
+    tolerance = 0.1
+    lang = None
+    quantization = None
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print(help_text)
+            sys.exit()
+        elif o in ("-c", "--corpus"):
+            corpus = a
+        elif o in ("-s", "--synthetic"):
+            synthetic = int(a)
+        elif o in ("-r", "--repeat"):
+            repeat = int(a)
+        elif o in ("-b", "--backend"):
+            backend = a
+        elif o == "--baseline":
+            baseline_file = a
+        elif o == "--save-baseline":
+            save_baseline = True
+        elif o == "--tolerance":
+            tolerance = float(a)
+        elif o == "--lang":
+            lang = a
+        elif o == "--quantization":
+            quantization = a
+
+    Logger.set_level('error')
+    config['result_cache']['enabled'] = False
+    config['ocr_cache']['disk_enabled'] = False
+
+    image_files = list_images(corpus) if os.path.exists(corpus) else []
+    synthetic_folder = tempfile.mkdtemp(prefix='board_benchmark_')
+    image_files += synthetic_boards(synthetic_folder, synthetic)
+    if not image_files:
+        print('No boards to benchmark')
+        sys.exit(2)
+
+    try:
+        report = run_benchmark(image_files, repeat, lang, backend)
+        if quantization:
+            report['quantization'] = compare_quantization(image_files, repeat, lang, quantization, synthetic_folder)
+    finally:
+        shutil.rmtree(synthetic_folder)
+    report['corpus_boards'] = len(image_files) - synthetic
+    report['synthetic_boards'] = synthetic
+
+    if save_baseline:
+        with open(baseline_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(json.dumps(report, indent=2))
+        print('Baseline saved in %s' % baseline_file)
+        return
+
+    regressions = []
+    if os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        if baseline['boards'] != report['boards']:
+            print('The baseline ran %d boards and this run %d, the results may not be comparable' %
+                  (baseline['boards'], report['boards']))
+        regressions = find_regressions(report, baseline, tolerance)
+    report['regressions'] = regressions
+    print(json.dumps(report, indent=2))
+
+    for regression in regressions:
+        print('Regression in %s: %g -> %g (%+.1f%%)' % (regression['measure'], regression['baseline'],
+                                                         regression['value'], regression['change'] * 100))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
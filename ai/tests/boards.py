@@ -6,22 +6,35 @@ from tests.test_helper import TestHelper
 from utils import data_utils
 
 
-def process_image(board):
-    process = subprocess.Popen('cd ../; python3 ./process_board.py -i ./dataset/boards/' + board + '.jpg --log error',
-                               shell=True, stdout=subprocess.PIPE)
-    out, err = process.communicate()
-    return json.loads(out.decode('utf-8'))
+def board_image(board_num):
+    return './dataset/boards/' + board_num + '.jpg'
 
 
-def evaluate_board(board):
+def process_images(board_nums):
+    """Process all the boards with one process_board run, reading the images to process from stdin"""
+    process = subprocess.Popen('cd ../; python3 ./process_board.py --batch - --log error',
+                               shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out, err = process.communicate('\n'.join(board_image(board_num) for board_num in board_nums).encode('utf-8'))
+    results = [json.loads(line) for line in out.decode('utf-8').splitlines() if line.strip()]
+    return {result['image']: result for result in results}
+
+
+def evaluate_board(board, image_data):
     board_num = ''.join([i for i in board if i.isdigit()])
-    image_data = process_image(board_num)
     board_data = json.loads(open('./boards_data/' + board_num + '.json').read())
     match_relations = 0
     match_items = 0
     match_users = 0
     image_users = []
 
+    if image_data is None or 'error' in image_data:
+        # A board that failed finds nothing, the rest of the boards are still evaluated
+        print('=========================================')
+        print('Board #%s' % board_num)
+        print('Failed: %s' % (image_data['error'] if image_data is not None else 'no result'))
+        print('=========================================')
+        return 0, 0, 0, len(board_data['relations']), len(board_data['items']), len(board_data['users']), 0, 0, 0
+
     for relation in image_data['relations']:
         found = elem_found(board_data['relations'], relation['text'])
         if found:
@@ -74,6 +87,7 @@ match_users = 0
 
 boards_perfect_found = []
 boards_perfect_match = []
+boards_failed = []
 
 
 def compare_boards(b1, b2):
@@ -85,13 +99,20 @@ def compare_boards(b1, b2):
 
 boards = os.listdir('./boards_data')
 boards.sort(key=functools.cmp_to_key(compare_boards))
+boards_results = process_images([''.join([i for i in board if i.isdigit()]) for board in boards
+                                 if not board.startswith('.')])
 for board in boards:
     if not board.startswith('.'):
-        fr, fi, fu, tr, ti, tu, mr, mi, mu = evaluate_board(board)
-        if tr == fr and ti == fi:
-            boards_perfect_found.append(board)
-        if tr == mr and ti == mi:
-            boards_perfect_match.append(board)
+        board_num = ''.join([i for i in board if i.isdigit()])
+        board_result = boards_results.get(board_image(board_num))
+        fr, fi, fu, tr, ti, tu, mr, mi, mu = evaluate_board(board, board_result)
+        if board_result is None or 'error' in board_result:
+            boards_failed.append(board)
+        else:
+            if tr == fr and ti == fi:
+                boards_perfect_found.append(board)
+            if tr == mr and ti == mi:
+                boards_perfect_match.append(board)
         total_relations += tr
         total_items += ti
         total_users += tu
@@ -128,5 +149,6 @@ print('Users Match: %f%%' % ((match_users / total_users) * 100))
 print('Total Found: %f%%' % ((found_elems / total_elems) * 100))
 print('Total Match: %f%%' % ((match_elems / total_elems) * 100))
 
-print('\nBoards Perfect Found: %f%%' % ((len(boards_perfect_found) / len(boards)) * 100))
+print('\nBoards Failed: %d/%d %s' % (len(boards_failed), len(boards), ' '.join(boards_failed)))
+print('Boards Perfect Found: %f%%' % ((len(boards_perfect_found) / len(boards)) * 100))
 print('Boards Perfect Match: %f%%' % ((len(boards_perfect_match) / len(boards)) * 100))
@@ -0,0 +1,82 @@
+import sys
+import time
+import numpy as np
+import os.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils import ocr_utils
+from tests.test_helper import TestHelper
+
+
+# Loop versions of the border removal, used as reference
+
+def loop_remove_elem_border(image):
+    size = min(image.shape[0], image.shape[1])
+    limit = ocr_utils.border_limit_color
+    i = 0
+    while sum(image[0]) / len(image[0]) < limit and i < (size // 2) - 1:
+        i += 1
+        image = image[1:, :]
+    i = 0
+    while sum(image[image.shape[0] - 1]) / len(image[image.shape[0] - 1]) < limit and i < (size // 2) - 1:
+        i += 1
+        image = image[:image.shape[0] - 1, :]
+    i = 0
+    while sum(image[:, 0]) / len(image[:, 0]) < limit and i < (size // 2) - 1:
+        i += 1
+        image = image[:, 1:]
+    i = 0
+    while sum(image[:, image.shape[1] - 1]) / len(image[:, image.shape[1] - 1]) < limit and i < (size // 2) - 1:
+        i += 1
+        image = image[:, :image.shape[1] - 1]
+    return image
+
+
+def loop_remove_user_border(image, extra=0.):
+    size = min(image.shape[0], image.shape[1])
+    i = 0
+    while max(image[0, 0], image[image.shape[0] - 1, 0], image[0, image.shape[1] - 1],
+              image[image.shape[0] - 1, image.shape[1] - 1]) > ocr_utils.user_border_limit_color and i < size // 3:
+        i += 1
+        image = image[1:image.shape[0] - 1, 1:image.shape[1] - 1]
+    for i in range(int(size * extra)):
+        image = image[1:image.shape[0] - 1, 1:image.shape[1] - 1]
+    return image
+
+
+def bordered_image(random, height, width, border, color):
+    image = random.randint(150, 256, size=(height, width)).astype(float)
+    image[:border[0], :] = color
+    image[height - border[1]:, :] = color
+    image[:, :border[2]] = color
+    image[:, width - border[3]:] = color
+    return image
+
+
+def benchmark(function, images):
+    start_time = time.time()
+    for image in images:
+        function(image)
+    return time.time() - start_time
+
+
+random = np.random.RandomState(0)
+elem_images = [bordered_image(random, random.randint(20, 400), random.randint(20, 400),
+                              random.randint(0, 60, size=4), random.randint(0, 200)) for i in range(200)]
+user_images = [bordered_image(random, random.randint(10, 120), random.randint(10, 120),
+                              random.randint(0, 30, size=4), random.randint(100, 256)) for i in range(200)]
+
+test = TestHelper()
+for image in elem_images:
+    test.expect_equal(np.array_equal(loop_remove_elem_border(image), ocr_utils._remove_elem_border(image)), True)
+for image in user_images:
+    test.expect_equal(np.array_equal(loop_remove_user_border(image), ocr_utils._remove_user_border(image)), True)
+    test.expect_equal(np.array_equal(loop_remove_user_border(image, .1), ocr_utils._remove_user_border(image, .1)), True)
+print('Same crops: %i/%i - %f%%' % (test.match, test.total, test.get_percentage()))
+
+loop_time = benchmark(loop_remove_elem_border, elem_images)
+vectorized_time = benchmark(ocr_utils._remove_elem_border, elem_images)
+print('Elements: loop %fs, vectorized %fs, %.1fx faster' % (loop_time, vectorized_time, loop_time / vectorized_time))
+
+loop_time = benchmark(loop_remove_user_border, user_images)
+vectorized_time = benchmark(ocr_utils._remove_user_border, user_images)
+print('Users: loop %fs, vectorized %fs, %.1fx faster' % (loop_time, vectorized_time, loop_time / vectorized_time))
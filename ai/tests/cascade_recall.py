@@ -0,0 +1,108 @@
+import getopt
+import sys
+import numpy as np
+import os.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from config import config
+from process_board import BoardProcessor, list_images
+from utils import data_utils
+from utils import dataset_utils
+from utils import image_utils
+from utils.logger import Logger
+
+# Recall lost by the cascade that rejects background windows before the model.
+# On the test split it prints the part of each label passing the cascade for a range of min_std thresholds.
+# With --boards it also compares the items and relations found in those boards with and without the cascade.
+# Run it from the ai folder: python3 tests/cascade_recall.py [--boards <directory|glob|manifest>]
+
+labels = {0: 'items', 1: 'relations', 2: 'users', 3: 'outliers'}
+
+
+def dataset_pass_rates(dataset, cascade_config):
+    """Part of the samples of each label passing the cascade"""
+    images, sample_labels = dataset.get(np.arange(len(dataset)))
+    size = config['image_size']
+    stats = [image_utils.window_statistics(image, np.array([0]), np.array([0]), size,
+                                           cascade_config['edge_threshold']) for image in images]
+    stds = np.array([std[0] for std, edge_density in stats])
+    edge_densities = np.array([edge_density[0] for std, edge_density in stats])
+    passed = data_utils.passes_cascade(stds, edge_densities, cascade_config)
+    return {label: float(np.mean(passed[sample_labels == label])) if np.any(sample_labels == label) else None
+            for label in labels}
+
+
+def zone_overlap(zone1, zone2):
+    """Intersection over union of two zones"""
+    height = min(zone1[1], zone2[1]) - max(zone1[0], zone2[0])
+    width = min(zone1[3], zone2[3]) - max(zone1[2], zone2[2])
+    if height <= 0 or width <= 0:
+        return 0.
+    intersection = height * width
+    area1 = (zone1[1] - zone1[0]) * (zone1[3] - zone1[2])
+    area2 = (zone2[1] - zone2[0]) * (zone2[3] - zone2[2])
+    return intersection / (area1 + area2 - intersection)
+
+
+def compare_boards(source):
+    """Elements found by the full model that the cascade keeps, and model evaluations it saves, over some boards"""
+    config['profiling']['enabled'] = True
+    processor = BoardProcessor()
+    found = 0
+    kept = 0
+    evaluations = {False: 0, True: 0}
+    for image_file in list_images(source):
+        elements = {}
+        for enabled in [False, True]:
+            config['cascade']['enabled'] = enabled
+            detection = processor.detect(image_file, None, True)
+            counters = detection.profile.to_dict()['counters']
+            evaluations[enabled] += counters.get('windows.scanned', 0) - counters.get('windows.cascade_rejected', 0)
+            elements[enabled] = detection.relations + detection.items
+        board_kept = len([element for element in elements[False]
+                          if any(zone_overlap(element['zone'], other['zone']) >= 0.5 for other in elements[True])])
+        print('%s: %d/%d elements kept' % (image_file, board_kept, len(elements[False])))
+        found += len(elements[False])
+        kept += board_kept
+    processor.close()
+
+    print('\nElements kept: %d/%d - %f%%' % (kept, found, kept * 100 / max(found, 1)))
+    print('Model evaluations: %d without the cascade, %d with it (%.1fx fewer)' %
+          (evaluations[False], evaluations[True], evaluations[False] / max(evaluations[True], 1)))
+
+
+def main(argv):
+    help_text = 'Usage: cascade_recall.py [--boards <directory|glob|manifest>]'
+    try:
+        opts, args = getopt.getopt(argv, "hb:", ['help', 'boards='])
+    except getopt.GetoptError:
+        print(help_text)
+        sys.exit(2)
+
+    boards = None
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print(help_text)
+            sys.exit()
+        elif o in ("-b", "--boards"):
+            boards = a
+
+    Logger.set_level('error')
+    cascade_config = dict(config['cascade'])
+
+    train_dataset, test_dataset = dataset_utils.load_dataset(config['dataset']['folder'])
+    print('Pass rate of the test split with min_edge_density %g and edge_threshold %g' %
+          (cascade_config['min_edge_density'], cascade_config['edge_threshold']))
+    print('min_std  ' + '  '.join('%9s' % labels[label] for label in labels))
+    for min_std in [0., 0.01, 0.02, 0.03, 0.04, 0.06, 0.08, 0.1]:
+        cascade_config['min_std'] = min_std
+        pass_rates = dataset_pass_rates(test_dataset, cascade_config)
+        print('%7.2f  ' % min_std + '  '.join('%9s' % ('-' if pass_rates[label] is None else
+                                                       '%.2f%%' % (pass_rates[label] * 100)) for label in labels))
+
+    if boards is not None:
+        print('')
+        compare_boards(boards)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,142 @@
+import getopt
+import math
+import sys
+import numpy as np
+import os.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from config import config
+from process_board import BoardProcessor, list_images
+from tf_predictor import TensorFlowPredictor
+from utils import data_utils
+from utils import image_utils
+from utils.logger import Logger
+from tests.cascade_recall import zone_overlap
+from tests.test_helper import TestHelper
+
+# Compares the scores of the dense model with the ones of the sliding window model on real boards.
+# The dense map approximates the windows, with cells every dense_stride pixels and the convolutions seeing the pixels
+# around each window, so dense_scoring changes the elements found and not only the speed.
+# It prints the agreement of the windows at each level of the boards, and the elements found with both models.
+# Run it from the ai folder after training: python3 tests/dense_scoring_parity.py [--boards <directory|glob|manifest>]
+
+targets = [0, 1]
+
+
+def board_levels(shape):
+    """Reductions of a board scanned by data_utils.locate_labels"""
+    resize = math.ceil(min(shape[0], shape[1]) / 100)
+    return sorted(set(int(resize // pow(1.2, i)) for i in range(6)) - {0}, reverse=True)
+
+
+def compare_windows(image_files, window_predictor, dense_predictor):
+    """Agreement of the classes and matches of every window of the boards, scored by both models"""
+    window_size = config['image_size']
+    window_stride = 3
+
+    test_labels = TestHelper()
+    test_matches = TestHelper()
+    differences = []
+    for image_file in image_files:
+        board_match, board_total = test_labels.match, test_labels.total
+        pyramid = image_utils.ImagePyramid(image_utils.read_image_gray(image_file))
+        for resize in board_levels(pyramid.shape):
+            image_data = pyramid.normalized(resize)
+            if image_data.shape[0] < window_size or image_data.shape[1] < window_size:
+                continue
+            windows = image_utils.sliding_windows(image_data, window_size, window_stride)
+            ys, xs = np.mgrid[0:windows.shape[0], 0:windows.shape[1]]
+            ys = ys.ravel()
+            xs = xs.ravel()
+
+            window_types, window_confidences = data_utils.classify_images(windows[ys, xs], window_predictor)
+            scores = dense_predictor.predict(np.asarray([image_data]))[0]
+            dense_types, dense_confidences = data_utils.dense_window_scores(
+                scores, ys, xs, image_data.shape[0], image_data.shape[1], dense_predictor.dense_stride)
+
+            window_matches = np.isin(window_types, targets) & (window_confidences > config['match_min_confidence'])
+            dense_matches = np.isin(dense_types, targets) & (dense_confidences > config['match_min_confidence'])
+            for window_type, dense_type in zip(window_types, dense_types):
+                test_labels.expect_equal(window_type, dense_type)
+            # Only the windows that are a match in any of the models, the background is most of the board
+            for window_match, dense_match, window_type, dense_type in zip(window_matches, dense_matches,
+                                                                          window_types, dense_types):
+                if window_match or dense_match:
+                    test_matches.expect_equal((window_match, window_type), (dense_match, dense_type))
+            same = window_types == dense_types
+            differences.append(np.abs(window_confidences[same] - dense_confidences[same]))
+        print('%s: %i/%i windows with the same label' %
+              (image_file, test_labels.match - board_match, test_labels.total - board_total))
+
+    print('\nSame label: %i/%i - %f%%' % (test_labels.match, test_labels.total, test_labels.get_percentage()))
+    if test_matches.total:
+        print('Same match: %i/%i - %f%%' % (test_matches.match, test_matches.total, test_matches.get_percentage()))
+    differences = np.concatenate(differences) if differences else np.zeros(0)
+    if len(differences):
+        print('Confidence difference of the windows with the same label: mean %g, max %g' %
+              (differences.mean(), differences.max()))
+
+
+def compare_elements(image_files):
+    """Elements of the boards found with the sliding window that the dense model also finds, and the other way"""
+    elements = {}
+    for dense in [False, True]:
+        config['dense_scoring'] = dense
+        processor = BoardProcessor(backend='tensorflow')
+        elements[dense] = [processor.detect(image_file, None, True) for image_file in image_files]
+        processor.close()
+
+    test_window = TestHelper()
+    test_dense = TestHelper()
+    for window_detection, dense_detection in zip(elements[False], elements[True]):
+        window_elements = window_detection.relations + window_detection.items
+        dense_elements = dense_detection.relations + dense_detection.items
+        for element in window_elements:
+            test_window.expect_equal(any(zone_overlap(element['zone'], other['zone']) >= 0.5
+                                         for other in dense_elements), True)
+        for element in dense_elements:
+            test_dense.expect_equal(any(zone_overlap(element['zone'], other['zone']) >= 0.5
+                                        for other in window_elements), True)
+
+    print('\nSliding window elements found by the dense model: %i/%i - %f%%' %
+          (test_window.match, test_window.total, test_window.get_percentage() if test_window.total else 100.))
+    print('Dense model elements found by the sliding window: %i/%i - %f%%' %
+          (test_dense.match, test_dense.total, test_dense.get_percentage() if test_dense.total else 100.))
+
+
+def main(argv):
+    help_text = 'Usage: dense_scoring_parity.py [--boards <directory|glob|manifest>]'
+    try:
+        opts, args = getopt.getopt(argv, "hb:", ['help', 'boards='])
+    except getopt.GetoptError:
+        print(help_text)
+        sys.exit(2)
+
+    boards = './dataset/boards'
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print(help_text)
+            sys.exit()
+        elif o in ("-b", "--boards"):
+            boards = a
+
+    Logger.set_level('error')
+    config['result_cache']['enabled'] = False
+    image_files = list_images(boards)
+    if not image_files:
+        print('No boards to compare')
+        sys.exit(2)
+
+    model_format = config['inference_model']['format']
+    window_predictor = TensorFlowPredictor(model_format)
+    dense_predictor = TensorFlowPredictor(model_format, dense=True)
+    try:
+        compare_windows(image_files, window_predictor, dense_predictor)
+    finally:
+        window_predictor.close()
+        dense_predictor.close()
+
+    compare_elements(image_files)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
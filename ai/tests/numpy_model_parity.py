@@ -0,0 +1,53 @@
+import sys
+import time
+import numpy as np
+import os.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from config import config
+from numpy_model import NumpyModel
+from tf_predictor import TensorFlowPredictor
+from utils import dataset_utils
+from tests.test_helper import TestHelper
+
+# Compares the classification of the numpy backend, loaded from the exported weights, with the TensorFlow model
+# restored from the trained checkpoint. It exits with an error when they don't agree.
+# Run it from the ai folder after training: python3 tests/numpy_model_parity.py
+
+max_difference = 1e-4
+
+numpy_model = NumpyModel.load(config['inference_model']['weights_file'])
+tf_predictor = TensorFlowPredictor('checkpoint')
+
+# Random windows and the test split, when the dataset was loaded
+size = config['image_size']
+images = [np.random.RandomState(0).rand(1000, size, size, 1).astype(np.float32) - 0.5]
+if os.path.exists(os.path.join(config['dataset']['folder'], dataset_utils.manifest_file)):
+    train_dataset, test_dataset = dataset_utils.load_dataset(config['dataset']['folder'])
+    images.append(test_dataset.get(np.arange(len(test_dataset)))[0])
+images = np.concatenate(images)
+
+start_time = time.time()
+numpy_results = np.concatenate([numpy_model.predict(images[offset:offset + config['window_batch_size']])
+                                for offset in range(0, len(images), config['window_batch_size'])])
+numpy_time = time.time() - start_time
+
+start_time = time.time()
+tf_results = np.concatenate([tf_predictor.predict(images[offset:offset + config['window_batch_size']])
+                             for offset in range(0, len(images), config['window_batch_size'])])
+tf_time = time.time() - start_time
+tf_predictor.close()
+
+test_labels = TestHelper()
+test_probabilities = TestHelper()
+for numpy_result, tf_result in zip(numpy_results, tf_results):
+    test_labels.expect_equal(np.argmax(numpy_result), np.argmax(tf_result))
+    test_probabilities.expect_equal(np.abs(numpy_result - tf_result).max() <= max_difference, True)
+
+print('Same label: %i/%i - %f%%' % (test_labels.match, test_labels.total, test_labels.get_percentage()))
+print('Probabilities within %g: %i/%i - %f%%' % (max_difference, test_probabilities.match, test_probabilities.total,
+                                                test_probabilities.get_percentage()))
+print('Max difference: %g' % np.abs(numpy_results - tf_results).max())
+print('NumPy: %f seconds, TensorFlow: %f seconds' % (numpy_time, tf_time))
+
+if test_labels.match != test_labels.total or test_probabilities.match != test_probabilities.total:
+    sys.exit(1)
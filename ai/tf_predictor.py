@@ -0,0 +1,58 @@
+import tensorflow as tf
+from model import Model
+from model_config import model_config
+from utils import export_utils
+from utils import session_utils
+from utils.logger import Logger
+
+logger = Logger('tf_predictor')
+
+
+class TensorFlowPredictor:
+    """Runs the model in a TensorFlow session, loaded from the checkpoint or from an exported inference model"""
+
+    def __init__(self, model_format, dense=False):
+        self.graph = tf.Graph()
+        self.sess = session_utils.create_session(self.graph)
+        self.model = Model()
+        self.dense_stride = self.model.dense_stride
+        self.y_conv, self.model_file = self._load_model(model_format, dense)
+
+    def predict(self, images):
+        """Class probabilities of a batch of images, or the dense map of a one image batch with the dense model"""
+        return self.sess.run(self.y_conv, feed_dict=self.model.feed_dict(images))
+
+    def close(self):
+        self.sess.close()
+
+    def _load_model(self, model_format, dense):
+        """Load the model in the session graph, returns its output and the file it was loaded from"""
+        inference_config = model_config.get('inference_model')
+
+        if model_format == 'checkpoint':
+            with self.graph.as_default(), session_utils.device_scope():
+                y_conv = self.model.get_dense_model() if dense else self.model.get_model()
+
+                # Add an op to initialize the variables.
+                init_op = tf.initialize_all_variables()
+
+                # Add ops to save and restore all the variables.
+                saver = tf.train.Saver()
+
+            model_file = model_config.get('model_file')
+            self.sess.run(init_op)
+            saver.restore(self.sess, model_file)
+        elif model_format == 'frozen':
+            model_file = inference_config['dense_graph_file'] if dense else inference_config['graph_file']
+            with self.graph.as_default(), session_utils.device_scope():
+                y_conv = self.model.import_graph(export_utils.load_graph_def(model_file))
+        elif model_format == 'weights':
+            model_file = inference_config['weights_file']
+            weight_values = export_utils.load_weights(model_file)
+            with self.graph.as_default(), session_utils.device_scope():
+                y_conv = self.model.get_dense_model(weight_values) if dense else self.model.get_model(weight_values)
+        else:
+            raise ValueError('Unknown model format: %s' % model_format)
+
+        logger.info("Model restored from %s." % model_file)
+        return y_conv, model_file
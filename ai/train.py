@@ -1,38 +1,49 @@
-import numpy as np
-from six.moves import cPickle as pickle
+import getopt
+import sys
 from model import Model
 from model_config import model_config
 from training_session import TrainingSession
+from utils import dataset_utils
 from utils.logger import Logger
 
 logger = Logger('train')
 
 
-def reformat(dataset, labels):
-    dataset = np.asarray(dataset)
-    labels = np.asarray(labels)
-    dataset = dataset.reshape((-1, image_size, image_size, num_channels)).astype(np.float32)
-    labels = (np.arange(num_labels) == labels[:, None]).astype(np.float32)
-    return dataset, labels
-
-with open(model_config.get('dataset_pickle_file'), 'rb') as f:
-    pickle_data = pickle.load(f)
-    train_dataset = pickle_data['train_dataset']
-    train_labels = pickle_data['train_labels']
-    test_dataset = pickle_data['test_dataset']
-    test_labels = pickle_data['test_labels']
-    del pickle_data
-
-image_size = model_config.get('image_size')
-num_labels = model_config.get('num_labels')
-num_channels = model_config.get('image_channels')
-
-train_dataset, train_labels = reformat(train_dataset, train_labels)
-test_dataset, test_labels = reformat(test_dataset, test_labels)
-
-logger.info('Training set %s %s' % (train_dataset.shape, train_labels.shape))
-logger.info('Test set %s %s' % (test_dataset.shape, test_labels.shape))
-
-model = Model()
-training_session = TrainingSession()
-training_session.run_session(model, train_dataset, train_labels, test_dataset, test_labels)
+def main(argv):
+    help_text = 'Usage: train.py [--batch-size <size>] [--steps <steps>] [--learning-rate <rate>] ' \
+                '[--schedule <constant|exponential|step>] [--scale-learning-rate]'
+    try:
+        opts, args = getopt.getopt(argv, "hb:s:r:", ['help', 'batch-size=', 'steps=', 'learning-rate=', 'schedule=',
+                                                     'scale-learning-rate'])
+    except getopt.GetoptError:
+        print(help_text)
+        sys.exit(2)
+
+    training_config = dict(model_config.get('training'))
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print(help_text)
+            sys.exit()
+        elif o in ("-b", "--batch-size"):
+            training_config['batch_size'] = int(a)
+        elif o in ("-s", "--steps"):
+            training_config['num_steps'] = int(a)
+        elif o in ("-r", "--learning-rate"):
+            training_config['learning_rate'] = float(a)
+        elif o == "--schedule":
+            training_config['learning_rate_schedule'] = a
+        elif o == "--scale-learning-rate":
+            training_config['learning_rate_scaling'] = True
+
+    train_dataset, test_dataset = dataset_utils.load_dataset(model_config.get('dataset')['folder'])
+
+    logger.info('Training set %d' % len(train_dataset))
+    logger.info('Test set %d' % len(test_dataset))
+
+    model = Model()
+    training_session = TrainingSession(training_config)
+    training_session.run_session(model, train_dataset, test_dataset)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,12 +1,32 @@
 import tensorflow as tf
+import numpy as np
+import time
 from model_config import model_config
+from utils.augment_utils import Augmenter
+from utils import profile_utils
+from utils.batch_utils import BatchQueue
 from utils.logger import Logger
 
 logger = Logger('Trainer')
 
 
-def get_train_step(ce):
-    return tf.train.AdamOptimizer(1e-4).minimize(ce)
+def get_learning_rate(training_config, global_step):
+    learning_rate = training_config['learning_rate']
+    if training_config['learning_rate_scaling']:
+        # Linear scaling with the batch size
+        learning_rate *= training_config['batch_size'] / training_config['base_batch_size']
+
+    schedule = training_config['learning_rate_schedule']
+    if schedule == 'constant':
+        return learning_rate
+    if schedule in ('exponential', 'step'):
+        return tf.train.exponential_decay(learning_rate, global_step, training_config['learning_rate_decay_steps'],
+                                          training_config['learning_rate_decay'], staircase=schedule == 'step')
+    raise ValueError('Unknown learning rate schedule: %s' % schedule)
+
+
+def get_train_step(ce, learning_rate, global_step):
+    return tf.train.AdamOptimizer(learning_rate).minimize(ce, global_step=global_step)
 
 
 def get_cross_entropy(data, y):
@@ -22,39 +42,77 @@ def get_accuracy(cp):
 
 
 class Trainer:
-    def __init__(self, model):
+    def __init__(self, model, training_config=None):
         self.model = model
         self.config = model_config
-        self.batch_size = 10
+        self.training_config = training_config or model_config.get('training')
+        self.batch_size = self.training_config['batch_size']
+        self.evaluation_batch_size = 1000
         self.num_labels = model_config.get('num_labels')
         self.num_channels = model_config.get('image_channels')
+        self.augmenter = Augmenter() if model_config.get('augmentation')['enabled'] else None
 
         y_conv = model.get_model()
         self.label_data = tf.placeholder(tf.float32, shape=[None, self.num_labels])
         cross_entropy = get_cross_entropy(self.label_data, y_conv)
 
-        self.train_step = get_train_step(cross_entropy)
+        self.global_step = tf.Variable(0, trainable=False, name='global_step')
+        self.learning_rate = get_learning_rate(self.training_config, self.global_step)
+        self.train_step = get_train_step(cross_entropy, self.learning_rate, self.global_step)
         self.cross_entropy = get_correct_prediction(y_conv, self.label_data)
         self.accuracy = get_accuracy(self.cross_entropy)
 
-    def train_model(self, steps, labels, dataset):
-        for i in range(steps):
-            offset = (i * self.batch_size) % (labels.shape[0] - self.batch_size)
-            batch_data = dataset[offset:(offset + self.batch_size), :, :, :]
-            batch_labels = labels[offset:(offset + self.batch_size), :]
-
-            if i % 50 == 0:
-                train_accuracy = self.accuracy.eval(
-                    feed_dict={self.model.train_data: batch_data, self.label_data: batch_labels,
-                               self.model.keep_prob: 1.0})
-                logger.info("step %d/%d, training accuracy %g" % (i, steps, train_accuracy))
-
-            self.train_step.run(feed_dict={self.model.train_data: batch_data, self.label_data: batch_labels,
-                                           self.model.keep_prob: 0.5})
-
-    def evaluate_model(self, labels, dataset):
-        # Evaluate test data
-        test_data_accuracy = self.accuracy.eval(
-            feed_dict={self.model.train_data: dataset, self.label_data: labels, self.model.keep_prob: 1.0})
+    def train_model(self, steps, dataset):
+        batches = BatchQueue(len(dataset), self.batch_size,
+                             lambda indices: self._get_batch(dataset, indices, augment=True))
+        start_time = time.time()
+        log_time = start_time
+        log_step = 0
+        try:
+            for i in range(steps):
+                with profile_utils.timer('training.batch_wait'):
+                    batch_data, batch_labels = batches.get()
+
+                if i % 50 == 0:
+                    train_accuracy = self.accuracy.eval(feed_dict=self._feed_dict(batch_data, batch_labels))
+                    if i > log_step:
+                        examples_per_sec = (i - log_step) * self.batch_size / max(time.time() - log_time, 1e-9)
+                        logger.info("step %d/%d, training accuracy %g, %.1f examples/sec" %
+                                    (i, steps, train_accuracy, examples_per_sec))
+                    else:
+                        # There is no logging interval to measure the throughput yet
+                        logger.info("step %d/%d, training accuracy %g" % (i, steps, train_accuracy))
+                    log_time = time.time()
+                    log_step = i
+
+                with profile_utils.timer('training.step'):
+                    self.train_step.run(feed_dict=self._feed_dict(batch_data, batch_labels, keep_prob=0.5))
+                profile_utils.count('training.examples', len(batch_data))
+        finally:
+            batches.close()
+
+        logger.info("%d steps, %.1f examples/sec" % (steps, steps * self.batch_size / max(time.time() - start_time, 1e-9)))
+
+    def evaluate_model(self, dataset):
+        # Evaluate test data in batches, weighting each one by its size
+        test_data_accuracy = 0
+        for offset in range(0, len(dataset), self.evaluation_batch_size):
+            indices = np.arange(offset, min(offset + self.evaluation_batch_size, len(dataset)))
+            batch_data, batch_labels = self._get_batch(dataset, indices)
+            batch_accuracy = self.accuracy.eval(feed_dict=self._feed_dict(batch_data, batch_labels))
+            test_data_accuracy += batch_accuracy * len(indices) / len(dataset)
         logger.info("test accuracy %g" % test_data_accuracy)
         return test_data_accuracy
+
+    def _feed_dict(self, batch_data, batch_labels, keep_prob=1.0):
+        feed_dict = self.model.feed_dict(batch_data, keep_prob)
+        feed_dict[self.label_data] = batch_labels
+        return feed_dict
+
+    def _get_batch(self, dataset, indices, augment=False):
+        """Images and one-hot labels of the samples at the indices"""
+        batch_data, batch_labels = dataset.get(indices)
+        if augment and self.augmenter is not None:
+            batch_data, batch_labels = self.augmenter.augment(batch_data, batch_labels)
+        batch_labels = (np.arange(self.num_labels) == batch_labels[:, None]).astype(np.float32)
+        return batch_data, batch_labels
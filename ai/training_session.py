@@ -1,46 +1,84 @@
 import tensorflow as tf
 import time
+from model_config import model_config
 from trainer import Trainer
+from utils import export_utils
+from utils import profile_utils
+from utils import quantize_utils
+from utils import session_utils
 from utils.logger import Logger
 
 logger = Logger('Training Session')
 
 
 class TrainingSession:
-    def __init__(self):
+    def __init__(self, training_config=None):
         self.trainer = None
         self.sess = None
         self.graph = None
         self.saver = None
-        self.num_training_steps = 10000
+        self.training_config = training_config or model_config.get('training')
+        self.num_training_steps = self.training_config['num_steps']
 
-    def run_session(self, model, train_dataset, train_labels, test_dataset, test_labels):
+    def run_session(self, model, train_dataset, test_dataset):
         start_time = time.time()
-        self.graph, init_op = self._create_graph(model)
-        with tf.Session(graph=self.graph) as self.sess:
+        profile = profile_utils.start() if model_config.get('profiling')['enabled'] else None
+        with profile_utils.timer('training.create_graph'):
+            self.graph, init_op = self._create_graph(model)
+        with session_utils.create_session(self.graph) as self.sess:
             self.sess.run(init_op)
 
             # Train the CNN
-            self.trainer.train_model(self.num_training_steps, train_labels, train_dataset)
+            with profile_utils.timer('training.train'):
+                self.trainer.train_model(self.num_training_steps, train_dataset)
 
             # Evaluate test data
-            self.trainer.evaluate_model(test_labels, test_dataset)
+            with profile_utils.timer('training.evaluate'):
+                self.trainer.evaluate_model(test_dataset)
+                self._evaluate_quantization(test_dataset)
 
             # Train test data
             test_train_steps = int(self.num_training_steps * self.trainer.config.get('test_dataset_percentage'))
-            self.trainer.train_model(test_train_steps, test_labels, test_dataset)
+            with profile_utils.timer('training.train_test'):
+                self.trainer.train_model(test_train_steps, test_dataset)
 
             logger.info("Training Time: %s seconds" % (time.time() - start_time))
-            self._save_trained_model()
+            with profile_utils.timer('training.save'):
+                self._save_trained_model()
+                self._export_inference_model()
+
+        if profile is not None:
+            profile_utils.stop()
+            logger.info('Profile %s' % profile.to_json())
 
     def _save_trained_model(self):
         save_path = self.saver.save(self.sess, self.trainer.config.get('model_file'))
         logger.info("Model saved in file: %s" % save_path)
 
+    def _export_inference_model(self):
+        weight_values = self.sess.run(self.trainer.model.weights)
+        export_utils.export_inference_model(weight_values)
+
+        inference_config = model_config.get('inference_model')
+        if inference_config['quantization']:
+            quantized_values = quantize_utils.quantize_weights(weight_values, inference_config['quantization'])
+            quantize_utils.save_quantized_weights(quantized_values, inference_config['quantized_weights_file'])
+
+    def _evaluate_quantization(self, dataset):
+        """Log the accuracy lost by the configured quantization"""
+        quantization = model_config.get('inference_model')['quantization']
+        if not quantization:
+            return
+        weight_values = self.sess.run(self.trainer.model.weights)
+        quantized_values = quantize_utils.quantize_weights(weight_values, quantization)
+        float_accuracy, quantized_accuracy = quantize_utils.compare_accuracy(weight_values, quantized_values, dataset)
+        logger.info("test accuracy float32 %g, %s %g (%+g)" %
+                    (float_accuracy, quantization, quantized_accuracy, quantized_accuracy - float_accuracy))
+
     def _create_graph(self, model):
         graph = tf.Graph()
-        with graph.as_default():
-            self.trainer = Trainer(model)
+        with graph.as_default(), session_utils.device_scope():
+            self.trainer = Trainer(model, self.training_config)
 
             # Add an op to initialize the variables.
             init_op = tf.initialize_all_variables()
@@ -0,0 +1,69 @@
+import numpy as np
+from config import config
+from utils import image_utils
+from utils.logger import Logger
+
+logger = Logger('augment_utils')
+
+
+class Augmenter:
+    """Builds variations of the training samples at batch time, instead of storing them in the dataset.
+    Each image is rotated by one of the rotations of its label, and part of the batch is replaced by synthetic
+    items and relations made by pasting an object on a background. The variations are seeded to be reproducible."""
+
+    def __init__(self, seed=config['augmentation']['seed']):
+        self.random = np.random.RandomState(seed)
+        self.rotations = config['augmentation']['rotations']
+        self.synthetic_fractions = config['augmentation']['synthetic_fractions']
+        self.image_size = config['image_size']
+
+        # Objects and background sizes of the labels with synthetic samples
+        self.objects = {
+            0: image_utils.load_original_images(config['item']['objects_folder'])[0],
+            1: image_utils.load_original_images(config['relation']['objects_folder'])[0],
+        }
+        self.background_sizes = {
+            0: config['item']['background_size'],
+            1: config['relation']['background_size'],
+        }
+        self.backgrounds = image_utils.load_original_images(config['backgrounds']['original_folder'])[0]
+        logger.info('Loaded %d item objects, %d relation objects and %d backgrounds' %
+                    (len(self.objects[0]), len(self.objects[1]), len(self.backgrounds)))
+
+    def augment(self, images, labels):
+        """Rotated and synthetic version of a batch of normalized images with their labels"""
+        images = images.copy()
+        labels = labels.copy()
+
+        # Rotate each image by one of the rotations of its label
+        image_rotations = np.zeros(len(labels), dtype=int)
+        for label, rotations in self.rotations.items():
+            with_label = labels == label
+            image_rotations[with_label] = self.random.choice(rotations, size=np.count_nonzero(with_label))
+        for rotation in np.unique(image_rotations):
+            rotated = image_rotations == rotation
+            images[rotated] = np.rot90(images[rotated], rotation, axes=(1, 2))
+
+        # Replace part of the batch with synthetic samples
+        positions = self.random.permutation(len(labels))
+        start = 0
+        for label, fraction in self.synthetic_fractions.items():
+            if not len(self.objects[label]) or not len(self.backgrounds):
+                continue
+            total_synthetic = self.random.binomial(len(labels), fraction)
+            for i in positions[start:start + total_synthetic]:
+                images[i] = self.synthetic_image(label)
+                labels[i] = label
+            start += total_synthetic
+
+        return images, labels
+
+    def synthetic_image(self, label):
+        """Normalized image of a random object of the label pasted on a random background"""
+        object_image = self.objects[label][self.random.randint(len(self.objects[label]))]
+        background = self.backgrounds[self.random.randint(len(self.backgrounds))]
+        size = self.random.randint(self.background_sizes[label][0], self.background_sizes[label][1] + 1)
+        background = image_utils.resize_image(background, size, size)
+        image_data = image_utils.paste_image(object_image, background)
+        image_data = image_utils.resize_image(image_data, self.image_size, self.image_size)
+        return image_utils.normalize_image(image_data)
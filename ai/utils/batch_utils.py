@@ -0,0 +1,66 @@
+import queue
+import threading
+import numpy as np
+from config import config
+from utils.logger import Logger
+
+logger = Logger('batch_utils')
+
+
+class BatchQueue:
+    """Prepares batches in a background thread, so the training steps don't wait for the data.
+    The samples are shuffled again on every epoch, and load_batch gets the sorted indices of each batch."""
+
+    def __init__(self, total_samples, batch_size, load_batch, prefetch=config['training']['prefetch_batches'],
+                 seed=None):
+        if total_samples <= 0:
+            raise ValueError('Can not make batches of an empty dataset')
+        self.total_samples = total_samples
+        self.batch_size = min(batch_size, total_samples)
+        self.load_batch = load_batch
+        self.random = np.random.RandomState(seed)
+        self.epoch = 0
+        self._queue = queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get(self):
+        """Next batch, waits until it is ready"""
+        batch = self._queue.get()
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    def close(self):
+        self._stop.set()
+        while self._thread.is_alive():
+            # Make room so a blocked producer can see it has to stop
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._thread.join(0.1)
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                order = self.random.permutation(self.total_samples)
+                for offset in range(0, self.total_samples - self.batch_size + 1, self.batch_size):
+                    batch = self.load_batch(np.sort(order[offset:offset + self.batch_size]))
+                    if not self._put(batch):
+                        return
+                self.epoch += 1
+                logger.debug('Finished epoch %d' % self.epoch)
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
@@ -0,0 +1,81 @@
+import json
+import os
+from utils import cache_utils
+from utils.logger import Logger
+
+logger = Logger('build_utils')
+
+manifest_file = '.manifest.json'
+
+
+def file_signature(path):
+    """Modification time and size of a file"""
+    stat = os.stat(path)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+
+class BuildManifest:
+    """Record of the input files and parameters each output of a folder was built from, so an incremental build only
+    regenerates the outputs whose inputs or parameters changed.
+    The manifest is a dot-file, so it is skipped when the images of the folder are loaded."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, manifest_file)
+        self.outputs = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.outputs = json.load(f)
+
+    def is_fresh(self, output, params):
+        """Check if an output exists and was built with the same parameters from inputs that did not change"""
+        record = self.outputs.get(output)
+        if record is None or record['params'] != params:
+            return False
+        if not os.path.exists(os.path.join(self.folder, output)):
+            return False
+        for path, signature in record['inputs'].items():
+            if not self._is_same_file(path, signature):
+                return False
+        return True
+
+    def record(self, output, inputs, params):
+        """Record the inputs and parameters an output was built from"""
+        inputs = {path: self._signature(path) for path in inputs}
+        self.outputs[output] = {'inputs': inputs, 'params': params}
+
+    def remove_stale(self, outputs):
+        """Remove the files of the folder that are not in the outputs of this build"""
+        outputs = set(outputs)
+        for name in os.listdir(self.folder):
+            if not name.startswith('.') and name not in outputs:
+                os.remove(os.path.join(self.folder, name))
+                logger.debug('Removed stale output %s' % name)
+        for name in list(self.outputs):
+            if name not in outputs:
+                del self.outputs[name]
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.outputs, f)
+        os.replace(tmp_path, self.path)
+
+    def _signature(self, path):
+        signature = file_signature(path)
+        signature['hash'] = cache_utils.file_digest(path)
+        return signature
+
+    def _is_same_file(self, path, signature):
+        """Compare a file with its signature, hashing it only when the modification time or size changed"""
+        if not os.path.exists(path):
+            return False
+        current = file_signature(path)
+        if current['mtime'] == signature['mtime'] and current['size'] == signature['size']:
+            return True
+        if current['size'] != signature['size'] or cache_utils.file_digest(path) != signature['hash']:
+            return False
+
+        # Same content, remember the new modification time to avoid hashing it again
+        signature['mtime'] = current['mtime']
+        return True
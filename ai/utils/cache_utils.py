@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from utils.logger import Logger
+
+logger = Logger('cache_utils')
+
+
+def make_key(*parts):
+    """Hash of any JSON serializable values, to be used as a cache key"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def file_digest(path):
+    """Hash of the content of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_digest(model_file):
+    """Hash of all the files of a model, a checkpoint is split in several files with the same prefix"""
+    folder = os.path.dirname(model_file) or '.'
+    prefix = os.path.basename(model_file)
+    files = sorted(f for f in os.listdir(folder) if f.startswith(prefix))
+    return make_key(*[file_digest(os.path.join(folder, f)) for f in files])
+
+
+class MemoryCache:
+    """Values kept in memory by key, removing the least recently used ones when there are more than max_entries.
+    It can be shared between threads."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._values:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._values.move_to_end(key)
+            return self._values[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+
+class DiskCache:
+    """JSON values stored in a folder by key, removing the least recently used ones when it grows over max_size bytes.
+    Values are written to a temporary file and renamed, so processes sharing the folder never read a partial value."""
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+        os.makedirs(folder, exist_ok=True)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # Touch the file to make it the most recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + '.json')
+
+    def _evict(self):
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.folder):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                logger.debug('Removed %s from cache' % path)
+            except OSError:
+                pass
+            total_size -= size
@@ -4,6 +4,7 @@ import functools
 from config import config
 from utils import image_utils
 from utils import ocr_utils
+from utils import profile_utils
 from utils.logger import Logger
 import shutil
 import os
@@ -11,84 +12,228 @@ import os
 logger = Logger('data_utils')
 
 
-def classify_image(image_data, model, y_conv, sess):
+def classify_image(image_data, predictor):
     """Classify an Image"""
-    result = y_conv.eval(feed_dict={model.train_data: [image_data], model.keep_prob: 1.0}, session=sess)
+    result = _predict(predictor, np.asarray([image_data]))
     result = result[0]
     type = np.argmax(result)
     confidence = result[type]
     return type, confidence
 
 
-def classify_with_window(image, targets, zone_marks, resize, model, y_conv, sess):
-    """Use a sliding window to classify multiple elements in the image"""
+def classify_images(images, predictor):
+    """Classify a list of images in batches"""
+    batch_size = config['window_batch_size']
+    results = []
+    for offset in range(0, len(images), batch_size):
+        batch = images[offset:offset + batch_size]
+        results.append(_predict(predictor, batch))
+    if not results:
+        return np.zeros(0, dtype=int), np.zeros(0)
+    results = np.concatenate(results)
+    types = np.argmax(results, axis=1)
+    confidences = results[np.arange(len(types)), types]
+    return types, confidences
+
+
+def _predict(predictor, images):
+    with profile_utils.timer('model.predict'):
+        return predictor.predict(images)
+
+
+def classify_with_window(image_data, targets, zone_marks, resize, predictor):
+    """Use a sliding window to classify multiple elements in the normalized image reduced resize times"""
     logger.info('Classifying with %dx resize' % resize)
 
     window_size = config['image_size']
     window_stride = 3
 
-    new_height = image.shape[0] // resize
-    new_width = image.shape[1] // resize
-    image_data = image_utils.clean_shape(image)
-    image_data = image_utils.resize_image(image_data, new_height, new_width)
-    image_data = image_utils.normalize_image(image_data)
-    matches = []
-    for y in range(new_height // window_stride):
-        for x in range(new_width // window_stride):
-            x_offset = x * window_stride
-            y_offset = y * window_stride
-            if x_offset + window_size > new_width or y_offset + window_size > new_height:
-                break
+    windows = image_utils.sliding_windows(image_data, window_size, window_stride)
+    marks = ZoneMarksTable(zone_marks, resize, image_data.shape[0], image_data.shape[1])
+
+    # Skip the windows already covered by previous matches, and the background rejected by the cascade
+    ys, xs = _unmarked_windows(windows.shape[0], windows.shape[1], marks)
+    ys, xs = _cascade_windows(image_data, ys, xs)
+    if len(ys) == 0:
+        return []
+
+    predictions, confidences = classify_images(windows[ys, xs], predictor)
+    return _select_matches(ys, xs, predictions, confidences, targets, marks)
+
+
+def classify_with_dense_map(image_data, targets, zone_marks, resize, predictor):
+    """Classify multiple elements in the normalized image reduced resize times with one pass of the dense model.
+    It approximates classify_with_window, so it can find other elements: tests/dense_scoring_parity.py measures
+    how far apart they are."""
+    logger.info('Classifying with %dx resize using the dense model' % resize)
+
+    window_size = config['image_size']
+    window_stride = 3
+
+    new_height = image_data.shape[0]
+    new_width = image_data.shape[1]
+    if new_height < window_size or new_width < window_size:
+        return []
+
+    scores = _predict(predictor, np.asarray([image_data]))[0]
+    marks = ZoneMarksTable(zone_marks, resize, new_height, new_width)
+
+    # Skip the windows already covered by previous matches
+    rows = (new_height - window_size) // window_stride + 1
+    cols = (new_width - window_size) // window_stride + 1
+    ys, xs = _unmarked_windows(rows, cols, marks)
+    if len(ys) == 0:
+        return []
+
+    predictions, confidences = dense_window_scores(scores, ys, xs, new_height, new_width, predictor.dense_stride)
+    return _select_matches(ys, xs, predictions, confidences, targets, marks)
+
+
+def dense_window_scores(scores, ys, xs, height, width, dense_stride):
+    """Classes and confidences of the windows in a dense map of an image.
+    Each window takes the scores of the nearest cell that fits in the image. The cells are dense_stride pixels
+    apart instead of the 3 pixels of the windows, and the convolutions of a cell see the pixels around the window
+    where a single window sees zero padding, so the scores are close to the ones of the windows but not the same."""
+    window_size = config['image_size']
+    window_stride = 3
+
+    cell_ys = np.minimum((ys * window_stride + dense_stride // 2) // dense_stride,
+                         (height - window_size) // dense_stride)
+    cell_xs = np.minimum((xs * window_stride + dense_stride // 2) // dense_stride,
+                         (width - window_size) // dense_stride)
+    results = scores[cell_ys, cell_xs]
+    predictions = np.argmax(results, axis=1)
+    confidences = results[np.arange(len(predictions)), predictions]
+    return predictions, confidences
+
 
-            zone = [
-                y_offset * resize,
-                (y_offset + window_size) * resize,
-                x_offset * resize,
-                (x_offset + window_size) * resize,
-            ]
-            zone_mathes = zone_marks[zone[0]:zone[1], zone[2]:zone[3]]
-            zone_size = zone_mathes.shape[0] * zone_mathes.shape[1]
-            zone_matches = np.sum(zone_mathes)
-
-            if zone_matches > zone_size * config['match_max_shared_zone']:
+def _unmarked_windows(rows, cols, marks):
+    """Rows and columns of the windows that are not covered by previous matches, in scan order"""
+    window_size = config['image_size']
+    window_stride = 3
+
+    ys, xs = np.mgrid[0:rows, 0:cols]
+    ys = ys.ravel()
+    xs = xs.ravel()
+    unmarked = ~marks.is_marked(ys * window_stride, xs * window_stride, window_size)
+    scanned = int(np.count_nonzero(unmarked))
+    profile_utils.count('windows.scanned', scanned)
+    profile_utils.count('windows.skipped', len(unmarked) - scanned)
+    return ys[unmarked], xs[unmarked]
+
+
+def _cascade_windows(image_data, ys, xs):
+    """Windows that pass the first stage of the cascade, the model only classifies those.
+    Windows with almost no contrast or edges are blank background, they can't be an item or a relation."""
+    cascade_config = config['cascade']
+    if not cascade_config['enabled'] or len(ys) == 0:
+        return ys, xs
+
+    window_size = config['image_size']
+    window_stride = 3
+
+    with profile_utils.timer('cascade'):
+        stds, edge_densities = image_utils.window_statistics(image_data, ys * window_stride, xs * window_stride,
+                                                             window_size, cascade_config['edge_threshold'])
+        passed = passes_cascade(stds, edge_densities, cascade_config)
+    profile_utils.count('windows.cascade_rejected', len(ys) - int(np.count_nonzero(passed)))
+    return ys[passed], xs[passed]
+
+
+def passes_cascade(stds, edge_densities, cascade_config):
+    """Check which windows pass the thresholds of the cascade"""
+    return (stds >= cascade_config['min_std']) & (edge_densities >= cascade_config['min_edge_density'])
+
+
+def _select_matches(ys, xs, predictions, confidences, targets, marks):
+    """Greedily keep the matches in scan order, as the marks of a match hide the windows after it"""
+    window_size = config['image_size']
+    window_stride = 3
+
+    matches = []
+    for y, x, prediction, confidence in zip(ys, xs, predictions, confidences):
+        if prediction in targets and confidence > config['match_min_confidence']:
+            if matches and marks.is_marked(y * window_stride, x * window_stride, window_size):
                 continue
 
-            window_image = image_data[y_offset:y_offset + window_size, x_offset:x_offset + window_size]
-            prediction, confidence = classify_image(window_image, model, y_conv, sess)
-            if prediction in targets and confidence > config['match_min_confidence']:
-                logger.debug('Prediction %d with confidence %f' % (prediction, confidence))
+            logger.debug('Prediction %d with confidence %f' % (prediction, confidence))
 
-                matches.append({
-                    'type': prediction,
-                    'zone': zone
-                })
-                zone_marks[zone[0]:zone[1], zone[2]:zone[3]] = 1
+            matches.append({
+                'type': prediction,
+                'zone': _window_zone(y, x, window_stride, window_size, marks.resize)
+            })
+            marks.mark(y * window_stride, x * window_stride, window_size)
 
     return matches
 
 
-def localte_users(image, item, model, y_conv, sess):
+def _window_zone(y, x, window_stride, window_size, resize):
+    """Zone of the original image covered by a window"""
+    x_offset = int(x) * window_stride
+    y_offset = int(y) * window_stride
+    return [
+        y_offset * resize,
+        (y_offset + window_size) * resize,
+        x_offset * resize,
+        (x_offset + window_size) * resize,
+    ]
+
+
+class ZoneMarksTable:
+    """Summed-area table of the zone marks on the grid of a pyramid level, so the zone a window shares with previous
+    matches is found in constant time. Each cell counts the marked pixels of the original image it covers."""
+
+    def __init__(self, zone_marks, resize, height, width):
+        self.zone_marks = zone_marks
+        self.resize = resize
+        self.cell_size = resize * resize
+        self.counts = zone_marks[:height * resize, :width * resize].reshape(height, resize, width, resize).sum(axis=(1, 3))
+        self.table = np.zeros((height + 1, width + 1), dtype=np.int64)
+        self.table[1:, 1:] = self.counts.cumsum(axis=0).cumsum(axis=1)
+
+    def is_marked(self, y_offset, x_offset, size):
+        """Check if the windows at the offsets of the level share more than the allowed zone with previous matches"""
+        table = self.table
+        zone_matches = table[y_offset + size, x_offset + size] - table[y_offset, x_offset + size] - \
+                       table[y_offset + size, x_offset] + table[y_offset, x_offset]
+        zone_size = pow(size * self.resize, 2)
+        return zone_matches > zone_size * config['match_max_shared_zone']
+
+    def mark(self, y_offset, x_offset, size):
+        """Mark the zone of a match, updating only the part of the table after it"""
+        delta = np.zeros((self.counts.shape[0] - y_offset, self.counts.shape[1] - x_offset), dtype=np.int64)
+        delta[:size, :size] = self.cell_size - self.counts[y_offset:y_offset + size, x_offset:x_offset + size]
+        self.counts[y_offset:y_offset + size, x_offset:x_offset + size] = self.cell_size
+        self.table[y_offset + 1:, x_offset + 1:] += delta.cumsum(axis=0).cumsum(axis=1)
+        self.zone_marks[y_offset * self.resize:(y_offset + size) * self.resize,
+                        x_offset * self.resize:(x_offset + size) * self.resize] = 1
+
+
+def localte_users(pyramid, item, predictor):
     """Locate users in an item"""
     logger.info('Classifying users in item %s' % item)
 
-    item_image = image[item['zone'][0]:item['zone'][1], item['zone'][2]:item['zone'][3]]
-    zone_marks = np.zeros((item_image.shape[0], item_image.shape[1]))
     resize = 5
     targets = [2]
 
-    matches = classify_with_window(item_image, targets, zone_marks, resize, model, y_conv, sess)
+    # Use the part of the pyramid level that covers the item
+    level_zone = [coordinate // resize for coordinate in item['zone']]
+    item_data = pyramid.normalized(resize)[level_zone[0]:level_zone[1], level_zone[2]:level_zone[3]]
+    zone_marks = np.zeros((item_data.shape[0] * resize, item_data.shape[1] * resize), dtype=bool)
+
+    matches = _classifier()(item_data, targets, zone_marks, resize, predictor)
     for match in matches:
-        match['zone'][0] += item['zone'][0]
-        match['zone'][1] += item['zone'][0]
-        match['zone'][2] += item['zone'][2]
-        match['zone'][3] += item['zone'][2]
+        match['zone'][0] += level_zone[0] * resize
+        match['zone'][1] += level_zone[0] * resize
+        match['zone'][2] += level_zone[2] * resize
+        match['zone'][3] += level_zone[2] * resize
 
     return matches
 
 
-def locate_labels(image, model, y_conv, sess):
-    zone_marks = np.zeros((image.shape[0], image.shape[1]))
-    resize = math.ceil(min(image.shape[0], image.shape[1]) / 100)
+def locate_labels(pyramid, predictor):
+    zone_marks = np.zeros((pyramid.shape[0], pyramid.shape[1]), dtype=bool)
+    resize = math.ceil(min(pyramid.shape[0], pyramid.shape[1]) / 100)
     targets = [0, 1]
     matches = []
     count = 0
@@ -100,7 +245,9 @@ def locate_labels(image, model, y_conv, sess):
         count = len(matches)
         current_resize = int(resize // pow(1.2, i))
         if current_resize != last_resize:
-            matches += classify_with_window(image, targets, zone_marks, current_resize, model, y_conv, sess)
+            with profile_utils.timer('locate.resize_%d' % current_resize):
+                image_data = pyramid.normalized(current_resize)
+                matches += _classifier()(image_data, targets, zone_marks, current_resize, predictor)
             last_resize = current_resize
         i += 1
 
@@ -110,7 +257,7 @@ def locate_labels(image, model, y_conv, sess):
     users = []
     for item in items:
         item['users'] = []
-        # item['users'] = localte_users(image, item, model, y_conv, sess)
+        # item['users'] = localte_users(pyramid, item, predictor)
         # users += item['users']
 
     for elem in (relations + items + users):
@@ -119,6 +266,12 @@ def locate_labels(image, model, y_conv, sess):
     return relations, items, users
 
 
+def _classifier():
+    """Classify with the dense model if it is the one loaded, otherwise with the sliding window"""
+    return classify_with_dense_map if config['dense_scoring'] else classify_with_window
+
+
+@profile_utils.timed('post.find_element_centers')
 def find_element_centers(relations, items):
     for elem in (relations + items):
         elem['center_x'] = (elem['zone'][3] - elem['zone'][2]) // 2 + elem['zone'][2]
@@ -126,6 +279,7 @@ def find_element_centers(relations, items):
     return relations, items
 
 
+@profile_utils.timed('post.find_relation_types')
 def find_relation_types(relations):
     if len(relations) == 0:
         return relations
@@ -157,6 +311,7 @@ def find_relation_types(relations):
     return relations
 
 
+@profile_utils.timed('post.group_by_relation')
 def group_by_relation(relations, items):
     relations = list(filter(lambda r: 'type' in r, relations))
     vertical_relations = list(filter(lambda r: r['type'] == 'vertical', relations))
@@ -199,6 +354,7 @@ def compare_relations(relation1, relation2):
     return 0
 
 
+@profile_utils.timed('post.sort_by_position')
 def sort_by_position(relations, items):
     relations.sort(key=functools.cmp_to_key(compare_relations))
     items.sort(key=lambda e: (e['center_y'], e['center_x']))
@@ -206,16 +362,19 @@ def sort_by_position(relations, items):
 
 
 def read_text(image_data, relations, items, lang):
-    for elem in (relations + items):
-        elem_image = image_data[elem['zone'][0]:elem['zone'][1], elem['zone'][2]:elem['zone'][3]]
-        elem['text'] = ocr_utils.read_text(elem_image, lang)
-    for item in items:
-        for user in item['users']:
-            user_image = image_data[user['zone'][0]:user['zone'][1], user['zone'][2]:user['zone'][3]]
-            user['text'] = ocr_utils.read_user(user_image)
+    elems = relations + items
+    elem_images = [image_data[elem['zone'][0]:elem['zone'][1], elem['zone'][2]:elem['zone'][3]] for elem in elems]
+    for elem, text in zip(elems, ocr_utils.read_texts(elem_images, lang)):
+        elem['text'] = text
+
+    users = [user for item in items for user in item['users']]
+    user_images = [image_data[user['zone'][0]:user['zone'][1], user['zone'][2]:user['zone'][3]] for user in users]
+    for user, text in zip(users, ocr_utils.read_users(user_images)):
+        user['text'] = text
     return relations, items
 
 
+@profile_utils.timed('post.prepare_response_data')
 def prepare_response_data(relations, items, users):
     for elem in (relations + items + users):
         elem.pop('zone', None)
@@ -0,0 +1,237 @@
+import json
+import os
+import shutil
+import zlib
+import numpy as np
+from config import config
+from utils import build_utils
+from utils.logger import Logger
+
+logger = Logger('dataset_utils')
+
+manifest_file = 'manifest.json'
+
+
+class DatasetWriter:
+    """Writes images and labels to a dataset folder, split in train and test shards.
+    Each shard is a raw array of images and another one of labels, so they can be memory-mapped when reading.
+    Generated samples are kept in their own shards by key, so generating them again replaces them, and rebuilding
+    the dataset from the image folders keeps them."""
+
+    def __init__(self, folder, append=False):
+        self.folder = folder
+        self.image_size = config['image_size']
+        self.dtype = config['dataset']['dtype']
+        self.shard_size = config['dataset']['shard_size']
+
+        manifest_path = os.path.join(folder, manifest_file)
+        manifest = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+
+        if append and manifest is not None:
+            self.manifest = manifest
+            self.dtype = self.manifest['dtype']
+        else:
+            self.manifest = {
+                'image_size': self.image_size,
+                'dtype': self.dtype,
+                'sources': {},
+                'splits': {
+                    'train': [],
+                    'test': []
+                },
+                'generated': {}
+            }
+            if manifest is not None and manifest.get('generated') and manifest['image_size'] == self.image_size \
+                    and manifest['dtype'] == self.dtype:
+                # Rebuilding from the image folders, keep the complete sets of generated samples
+                self.manifest['generated'] = {key: entry for key, entry in manifest['generated'].items()
+                                              if entry['complete']}
+                self._remove_files(keep=_shard_files(self.manifest))
+                self._save_manifest()
+                if self.manifest['generated']:
+                    logger.info('Keeping the generated samples of %s' % ', '.join(sorted(self.manifest['generated'])))
+            else:
+                if os.path.exists(folder):
+                    shutil.rmtree(folder)
+                os.makedirs(folder)
+        self.manifest.setdefault('generated', {})
+
+        # Continue the random split from the number of samples already written
+        total_images = sum(shard['count'] for shards in self.manifest['splits'].values() for shard in shards)
+        self.random = np.random.RandomState(config['dataset']['seed'] + total_images)
+        self._generated_randoms = {}
+
+    @property
+    def sources(self):
+        """Signature of each source file already written, by path"""
+        return self.manifest['sources']
+
+    @property
+    def generated(self):
+        """Parameters of each complete set of generated samples, by key"""
+        return {key: entry['params'] for key, entry in self.manifest['generated'].items() if entry['complete']}
+
+    def append(self, images, labels, sources=None, generated=None):
+        """Add normalized images with their labels, each one goes to the test split with the configured probability.
+        The signatures of the source files are recorded so incremental builds only append new files.
+        Generated samples are added to the set of their key, started with replace_generated."""
+        images = np.asarray(images).reshape((-1, self.image_size, self.image_size))
+        labels = np.asarray(labels)
+        random = self.random if generated is None else self._generated_randoms[generated]
+        test = random.rand(len(images)) < config['test_dataset_percentage']
+        self._write('train', images[~test], labels[~test], generated)
+        self._write('test', images[test], labels[test], generated)
+        for path in (sources or []):
+            self.manifest['sources'][path] = build_utils.file_signature(path)
+        self._save_manifest()
+
+    def replace_generated(self, key, params):
+        """Start the set of generated samples of a key, removing the samples it had.
+        Its split only depends on the key, so generating the same samples again writes the same dataset."""
+        entry = self.manifest['generated'].pop(key, None)
+        if entry is not None:
+            for shards in entry['splits'].values():
+                for shard in shards:
+                    for name in (shard['images'], shard['labels']):
+                        if os.path.exists(os.path.join(self.folder, name)):
+                            os.remove(os.path.join(self.folder, name))
+        self.manifest['generated'][key] = {'params': params, 'complete': False, 'splits': {'train': [], 'test': []}}
+        self._generated_randoms[key] = np.random.RandomState(
+            [config['dataset']['seed'], zlib.crc32(key.encode('utf-8'))])
+        self._save_manifest()
+
+    def complete_generated(self, key):
+        """Mark the set of generated samples of a key as complete, an interrupted one is generated again"""
+        self.manifest['generated'][key]['complete'] = True
+        self._save_manifest()
+
+    def _write(self, split, images, labels, generated=None):
+        if generated is None:
+            shards = self.manifest['splits'][split]
+            prefix = split
+        else:
+            shards = self.manifest['generated'][generated]['splits'][split]
+            prefix = '%s-%s' % (generated.replace('/', '_'), split)
+        while len(images):
+            if not shards or shards[-1]['count'] == self.shard_size:
+                name = '%s-%d' % (prefix, len(shards))
+                shards.append({'images': name + '.images', 'labels': name + '.labels', 'count': 0})
+            shard = shards[-1]
+            count = min(self.shard_size - shard['count'], len(images))
+            image_bytes = encode_images(images[:count], self.dtype)
+            label_bytes = labels[:count].astype(np.uint8)
+
+            # Drop anything after the recorded samples, left by a write that did not finish
+            with open(os.path.join(self.folder, shard['images']), 'ab') as f:
+                f.truncate(shard['count'] * image_bytes[0].nbytes)
+                f.write(image_bytes.tobytes())
+            with open(os.path.join(self.folder, shard['labels']), 'ab') as f:
+                f.truncate(shard['count'])
+                f.write(label_bytes.tobytes())
+            shard['count'] += count
+            images = images[count:]
+            labels = labels[count:]
+
+    def _remove_files(self, keep):
+        for name in os.listdir(self.folder):
+            if name not in keep:
+                os.remove(os.path.join(self.folder, name))
+
+    def _save_manifest(self):
+        tmp_path = os.path.join(self.folder, '.' + manifest_file)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.folder, manifest_file))
+
+
+class Dataset:
+    """Images and labels of a dataset split, memory-mapped from its shards"""
+
+    def __init__(self, folder, manifest, split):
+        self.image_size = manifest['image_size']
+        self.dtype = manifest['dtype']
+        self.shards = []
+        offsets = [0]
+        for shard in _split_shards(manifest, split):
+            if shard['count'] == 0:
+                continue
+            images = np.memmap(os.path.join(folder, shard['images']), dtype=self.dtype, mode='r',
+                               shape=(shard['count'], self.image_size, self.image_size))
+            labels = np.memmap(os.path.join(folder, shard['labels']), dtype=np.uint8, mode='r',
+                               shape=(shard['count'],))
+            self.shards.append((images, labels))
+            offsets.append(offsets[-1] + shard['count'])
+        self.offsets = np.array(offsets)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def get(self, indices):
+        """Normalized images shaped to be used by the model, and labels of the samples at the indices"""
+        indices = np.asarray(indices)
+        images = np.empty((len(indices), self.image_size, self.image_size), dtype=np.float32)
+        labels = np.empty(len(indices), dtype=np.uint8)
+        shard_ids = np.searchsorted(self.offsets, indices, side='right') - 1
+        for shard_id in np.unique(shard_ids):
+            in_shard = shard_ids == shard_id
+            shard_indices = indices[in_shard] - self.offsets[shard_id]
+            shard_images, shard_labels = self.shards[shard_id]
+            images[in_shard] = decode_images(shard_images[shard_indices], self.dtype)
+            labels[in_shard] = shard_labels[shard_indices]
+        return images.reshape((-1, self.image_size, self.image_size, 1)), labels
+
+
+class ArrayDataset:
+    """Images and labels of a dataset held in memory, read the same way as a stored Dataset"""
+
+    def __init__(self, images, labels):
+        self.images = np.asarray(images, dtype=np.float32)
+        self.labels = np.asarray(labels, dtype=np.uint8)
+        self.image_size = self.images.shape[1]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def get(self, indices):
+        """Normalized images shaped to be used by the model, and labels of the samples at the indices"""
+        images = self.images[indices]
+        return images.reshape((-1, self.image_size, self.image_size, 1)), self.labels[indices]
+
+
+def _split_shards(manifest, split):
+    """Shards of a split, with the ones of the complete sets of generated samples.
+    The samples of an interrupted set are left out until generate.py replaces them."""
+    shards = list(manifest['splits'][split])
+    for key, entry in sorted(manifest.get('generated', {}).items()):
+        if entry['complete']:
+            shards += entry['splits'][split]
+    return shards
+
+
+def _shard_files(manifest):
+    return set(name for split in ('train', 'test') for shard in _split_shards(manifest, split)
+               for name in (shard['images'], shard['labels']))
+
+
+def load_dataset(folder):
+    """Train and test splits of a dataset folder"""
+    with open(os.path.join(folder, manifest_file)) as f:
+        manifest = json.load(f)
+    return Dataset(folder, manifest, 'train'), Dataset(folder, manifest, 'test')
+
+
+def encode_images(images, dtype):
+    """Normalized images to the type they are stored in, uint8 keeps the original pixel values"""
+    if dtype == 'uint8':
+        return np.clip(np.rint(images * 255 + 255 / 2), 0, 255).astype(np.uint8)
+    return images.astype(dtype)
+
+
+def decode_images(images, dtype):
+    """Stored images to normalized float32 images"""
+    if dtype == 'uint8':
+        return (images.astype(np.float32) - 255 / 2) / 255
+    return images.astype(np.float32)
@@ -0,0 +1,50 @@
+import os
+import numpy as np
+import tensorflow as tf
+from config import config
+from model import Model
+from utils.logger import Logger
+
+logger = Logger('export_utils')
+
+
+def export_inference_model(weight_values):
+    """Write the inference artifacts of the trained weights: the frozen graphs of the model and its dense version,
+    and optionally a numpy file with the weights"""
+    export_config = config['inference_model']
+    write_frozen_graph(weight_values, export_config['graph_file'], dense=False)
+    write_frozen_graph(weight_values, export_config['dense_graph_file'], dense=True)
+    if export_config['export_weights']:
+        save_weights(weight_values, export_config['weights_file'])
+
+
+def write_frozen_graph(weight_values, graph_file, dense=False):
+    """Write an inference graph with the weights as float32 constants and without dropout"""
+    graph = tf.Graph()
+    with graph.as_default():
+        model = Model()
+        if dense:
+            model.get_dense_model(weight_values)
+        else:
+            model.get_model(weight_values)
+    folder, name = os.path.split(graph_file)
+    tf.train.write_graph(graph.as_graph_def(), folder or '.', name, as_text=False)
+    logger.info('Inference graph saved in file: %s' % graph_file)
+
+
+def load_graph_def(graph_file):
+    graph_def = tf.GraphDef()
+    with open(graph_file, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    return graph_def
+
+
+def save_weights(weight_values, weights_file):
+    """Save the weights in a numpy file, without the optimizer slots of the checkpoint"""
+    np.savez(weights_file, **{name: np.asarray(value, dtype=np.float32) for name, value in weight_values.items()})
+    logger.info('Model weights saved in file: %s' % weights_file)
+
+
+def load_weights(weights_file):
+    with np.load(weights_file) as values:
+        return {name: values[name] for name in values.files}
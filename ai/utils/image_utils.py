@@ -1,10 +1,12 @@
-import tensorflow as tf
+import numpy as np
+import multiprocessing
 import os
 import random
 from scipy import ndimage
 from scipy import misc
 from skimage.draw import line_aa
 from config import config
+from utils import profile_utils
 from utils.logger import Logger
 
 logger = Logger('image_utils')
@@ -12,21 +14,50 @@ logger = Logger('image_utils')
 
 def load_model_images(folder, image_size=config['image_size'], max_images=0):
     """Load all the images in a folder and prepare them to be used by the model"""
+    return load_image_files(list_model_images(folder, max_images), image_size)
+
+
+def list_model_images(folder, max_images=0):
+    """Paths of the images in a folder, skipping dot-files"""
     images = os.listdir(folder)
-    model_images = []
     total_images = max_images if max_images and max_images < len(images) else len(images)
-    for i in range(total_images):
-        if not images[i].startswith('.'):
-            image_file = os.path.join(folder, images[i])
-            model_images.append(prepare_model_image(image_file, image_size))
-            if i % 100 == 0:
-                logger.info('Loading images... %d/%d' % (i, total_images))
-
+    return [os.path.join(folder, image) for image in images[:total_images] if not image.startswith('.')]
+
+
+def load_image_files(image_files, image_size=config['image_size']):
+    """Load image files and prepare them to be used by the model.
+    The images are loaded by a pool of processes, straight into a shared float32 array."""
+    buffer = multiprocessing.RawArray('f', len(image_files) * image_size * image_size)
+    if image_files:
+        # The pool is terminated when it exits, also when a worker fails
+        with multiprocessing.Pool(config['loader_workers'] or None, initializer=_init_image_loader,
+                                  initargs=(buffer, image_size)) as pool:
+            tasks = pool.imap_unordered(_load_model_image, enumerate(image_files),
+                                        chunksize=config['loader_chunk_size'])
+            for i, _ in enumerate(tasks):
+                if i % 100 == 0:
+                    logger.info('Loading images... %d/%d' % (i, len(image_files)))
+            pool.close()
+            pool.join()
+
+    model_images = np.frombuffer(buffer, dtype=np.float32).reshape((-1, image_size, image_size, 1))
     logger.info('Loaded %d images' % len(model_images))
 
     return model_images
 
 
+def _init_image_loader(buffer, image_size):
+    """Set the shared array where the worker process writes the images"""
+    global loader_images, loader_image_size
+    loader_images = np.frombuffer(buffer, dtype=np.float32).reshape((-1, image_size, image_size, 1))
+    loader_image_size = image_size
+
+
+def _load_model_image(task):
+    index, image_file = task
+    loader_images[index] = prepare_model_image(image_file, loader_image_size)
+
+
 def prepare_model_image(image_file, image_size):
     """Prepare an image to be used by the model"""
     image_data = ndimage.imread(image_file, mode='L').astype(float)
@@ -53,10 +84,14 @@ def load_original_images(folder, image_size=None):
 
 
 def read_image(image_file):
-    image_data = ndimage.imread(image_file, mode='L').astype(float)
+    image_data = read_image_gray(image_file)
     return normalize_image(image_data), image_data
 
 
+def read_image_gray(image_file):
+    return ndimage.imread(image_file, mode='L').astype(float)
+
+
 def read_image_color(image_file):
     return ndimage.imread(image_file).astype(float)
 
@@ -72,16 +107,89 @@ def resize_image(image_data, height, width):
     return misc.imresize(image_data, (height, width), interp='bicubic', mode='L')
 
 
-def rotate_images(images, rotations=[1,2,3]):
-    tensors = []
-    for image in images:
-        if len(image.shape) == 2:
-            image = image.reshape(image.shape[0], image.shape[1], 1)
-        for i in rotations:
-            tensors.append(tf.image.rot90(image, i))
-    with tf.Session() as sess:
-        tf.initialize_all_variables().run()
-        return sess.run(tensors)
+def sliding_windows(image_data, window_size, stride):
+    """Strided view with every window of the image, indexed by window row and column"""
+    rows = (image_data.shape[0] - window_size) // stride + 1 if image_data.shape[0] >= window_size else 0
+    cols = (image_data.shape[1] - window_size) // stride + 1 if image_data.shape[1] >= window_size else 0
+    strides = image_data.strides
+    return np.lib.stride_tricks.as_strided(
+        image_data,
+        shape=(rows, cols, window_size, window_size) + image_data.shape[2:],
+        strides=(strides[0] * stride, strides[1] * stride) + strides,
+        writeable=False
+    )
+
+
+def integral_image(image_data):
+    """Summed-area table with a leading row and column of zeros, so the sum of any window takes four lookups"""
+    table = np.zeros((image_data.shape[0] + 1, image_data.shape[1] + 1))
+    table[1:, 1:] = image_data.cumsum(axis=0).cumsum(axis=1)
+    return table
+
+
+def window_sums(table, y_offsets, x_offsets, window_size):
+    """Sums of the windows starting at the offsets, from a summed-area table"""
+    y_ends = y_offsets + window_size
+    x_ends = x_offsets + window_size
+    return table[y_ends, x_ends] - table[y_offsets, x_ends] - table[y_ends, x_offsets] + table[y_offsets, x_offsets]
+
+
+def window_statistics(image_data, y_offsets, x_offsets, window_size, edge_threshold):
+    """Standard deviation and edge density of the windows starting at the offsets, from integral images.
+    A pixel is an edge when it differs more than edge_threshold from the pixel above or on its left."""
+    image = image_data.reshape(image_data.shape[:2]).astype(np.float64)
+    area = window_size * window_size
+    means = window_sums(integral_image(image), y_offsets, x_offsets, window_size) / area
+    squares = window_sums(integral_image(image * image), y_offsets, x_offsets, window_size) / area
+    stds = np.sqrt(np.maximum(squares - means * means, 0))
+
+    edges = np.zeros(image.shape, dtype=bool)
+    edges[:, 1:] |= np.abs(np.diff(image, axis=1)) > edge_threshold
+    edges[1:, :] |= np.abs(np.diff(image, axis=0)) > edge_threshold
+    edge_densities = window_sums(integral_image(edges), y_offsets, x_offsets, window_size) / area
+    return stds, edge_densities
+
+
+class ImagePyramid:
+    """Reduced versions of an image, each one is built when it is first used from the nearest larger one"""
+
+    def __init__(self, image):
+        self.image = clean_shape(image)
+        self.shape = self.image.shape
+        self._levels = {}
+        self._normalized_levels = {}
+
+    def level(self, resize):
+        """The image reduced resize times"""
+        if resize not in self._levels:
+            height = self.shape[0] // resize
+            width = self.shape[1] // resize
+            source = self.image
+            larger_levels = [r for r in self._levels if r < resize]
+            if larger_levels:
+                source = self._levels[max(larger_levels)]
+            with profile_utils.timer('pyramid.resize'):
+                self._levels[resize] = resize_image(source, height, width)
+        return self._levels[resize]
+
+    def normalized(self, resize):
+        """The image reduced resize times with values normalized to be used by the model"""
+        if resize not in self._normalized_levels:
+            self._normalized_levels[resize] = normalize_image(self.level(resize).astype(np.float32))
+        return self._normalized_levels[resize]
+
+
+def rotate_images(images, rotations=[1,2,3], batch_size=256):
+    """Rotate the images 90 degrees counterclockwise the number of times of each rotation.
+    The rotated images are yielded in the order of the images and then of the rotations, a batch at a time."""
+    for offset in range(0, len(images), batch_size):
+        batch = np.asarray(images[offset:offset + batch_size])
+        if len(batch.shape) == 3:
+            batch = batch.reshape(batch.shape + (1,))
+        rotated_batches = [np.rot90(batch, rotation, axes=(1, 2)) for rotation in rotations]
+        for i in range(len(batch)):
+            for rotated_batch in rotated_batches:
+                yield rotated_batch[i]
 
 
 def apply_random_brightness(images):
@@ -103,6 +211,20 @@ def draw_border(image, x_start, y_start, x_end, y_end):
     return image
 
 
+def paste_image(object_image, background):
+    """Copy of the background with the object pasted in the center"""
+    object_image = clean_shape(object_image)
+    background = clean_shape(background).copy()
+    object_size = object_image.shape
+    background_size = background.shape
+    position = [
+        (background_size[0] - object_size[0]) // 2,
+        (background_size[1] - object_size[1]) // 2,
+    ]
+    background[position[0]:object_size[0] + position[0], position[1]:object_size[1] + position[1]] = object_image
+    return background
+
+
 def clean_shape(image):
     """If the image only have one channel, removes the third dimension"""
     if len(image.shape) == 3:
@@ -1,25 +1,93 @@
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import numpy as np
 import pyocr
 import pyocr.builders
+import pyocr.tesseract
+from config import config
+from utils import cache_utils
+from utils import profile_utils
+from utils.logger import Logger
+
+logger = Logger('ocr_utils')
 
 border_limit_color = 162
 user_border_limit_color = 128
 ocr = pyocr.get_available_tools()[0]
+if ocr is not pyocr.tesseract:
+    logger.warn('%s runs without a process to kill, the OCR timeout is not applied' % ocr.get_name())
+executor = None
+# Deadline of the image read by each thread
+read_deadline = threading.local()
+text_cache = cache_utils.MemoryCache(config['ocr_cache']['max_entries'])
+text_disk_cache = None
+if config['ocr_cache']['disk_enabled']:
+    text_disk_cache = cache_utils.DiskCache(config['ocr_cache']['folder'], config['ocr_cache']['max_size'])
+# The disk hits are counted from the threads of the OCR pool
+disk_cache_hits = 0
+disk_cache_lock = threading.Lock()
+
+
+def read_texts(images, lang='english'):
+    """Read the text of many images concurrently, the results keep the order of the images"""
+    return _map_concurrently(functools.partial(read_text, lang=lang), images)
+
+
+def read_users(images):
+    """Read the users of many images concurrently, the results keep the order of the images"""
+    return _map_concurrently(read_user, images)
+
+
+def _map_concurrently(read_function, images):
+    """Run a read function over the images in the OCR pool.
+    Tesseract runs in its own process, so a bounded pool of threads keeps that many OCR processes busy.
+    Each image has the OCR timeout from when its reading starts, the Tesseract process still running at the
+    deadline is killed and the image is left with an empty text, so a bad image can't stall the board."""
+    global executor
+    profile_utils.count('ocr.images', len(images))
+    read_function = _with_deadline(read_function)
+    if config['ocr_workers'] <= 1:
+        return [read_function(image) for image in images]
+
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=config['ocr_workers'])
+
+    read_function = profile_utils.bind(read_function)
+    futures = [executor.submit(read_function, image) for image in images]
+    return [future.result() for future in futures]
+
+
+def _with_deadline(read_function):
+    """Wrap a read function to give each image the OCR timeout, counted from when its reading starts"""
+    @functools.wraps(read_function)
+    def wrapper(image_data):
+        read_deadline.time = time.time() + config['ocr_timeout']
+        try:
+            return read_function(image_data)
+        finally:
+            read_deadline.time = None
+    return wrapper
+
+
+def _time_left():
+    """Seconds left to read the current image, the whole timeout outside of _map_concurrently"""
+    deadline = getattr(read_deadline, 'time', None)
+    return config['ocr_timeout'] if deadline is None else deadline - time.time()
 
 
 def read_text(image_data, lang='english'):
-    text = ocr.image_to_string(
-        Image.fromarray(image_data),
-        lang=_map_language(lang),
-        builder=pyocr.builders.TextBuilder()
-    )
+    text = _image_to_string(image_data, lang=_map_language(lang))
     if text == '':
+        profile_utils.count('ocr.retries')
         image_data = _remove_elem_border(image_data)
-        text = ocr.image_to_string(
-            Image.fromarray(image_data),
-            lang=_map_language(lang),
-            builder=pyocr.builders.TextBuilder()
-        )
+        text = _image_to_string(image_data, lang=_map_language(lang))
     return text
 
 
@@ -27,83 +95,137 @@ def read_user(image_data):
     txt = _read_user_two_letters(image_data)
     txt = ''.join([i for i in txt if i.isalpha()])
     if len(txt) != 2:
+        profile_utils.count('ocr.retries')
         txt = _read_user_one_letter(image_data)
         txt = ''.join([i for i in txt if i.isalpha()])
     return txt.upper()
 
 
+def cache_stats():
+    """Counters of the OCR cache"""
+    with disk_cache_lock:
+        disk_hits = disk_cache_hits
+    return {
+        'hits': text_cache.hits,
+        'disk_hits': disk_hits,
+        'misses': text_cache.misses - disk_hits
+    }
+
+
 def _read_user_one_letter(image_data):
     image_data = _remove_user_border(image_data, .1)
-    return ocr.image_to_string(
-        Image.fromarray(image_data),
-        builder=pyocr.builders.TextBuilder(10)
-    )
+    return _image_to_string(image_data, tesseract_layout=10)
 
 
 def _read_user_two_letters(image_data):
     image_data = _remove_user_border(image_data)
-    return ocr.image_to_string(
-        Image.fromarray(image_data),
-        builder=pyocr.builders.TextBuilder(7)
-    )
-
-
-def _remove_elem_border(image, extra=0.):
-    size = min(image.shape[0], image.shape[1])
-    i = 0
-    while _elem_has_up_border(image) and i < (size // 2) - 1:
-        i += 1
-        image = image[1:, :]
-    i = 0
-    while _elem_has_down_border(image) and i < (size // 2) - 1:
-        i += 1
-        image = image[:image.shape[0] - 1, :]
-    i = 0
-    while _elem_has_left_border(image) and i < (size // 2) - 1:
-        i += 1
-        image = image[:, 1:]
-    i = 0
-    while _elem_has_right_border(image) and i < (size // 2) - 1:
-        i += 1
-        image = image[:, :image.shape[1] - 1]
-    return image
-
-
-def _elem_has_up_border(image):
-    color = sum(image[0]) / len(image[0])
-    return color < border_limit_color
+    return _image_to_string(image_data, tesseract_layout=7)
+
+
+def _image_to_string(image_data, lang=None, tesseract_layout=3):
+    """Run the OCR on an image, the same pixels with the same settings are read only once"""
+    global disk_cache_hits
+    pixels_hash = hashlib.sha1(np.ascontiguousarray(image_data).tobytes()).hexdigest()
+    key = cache_utils.make_key(pixels_hash, image_data.shape, str(image_data.dtype), lang, tesseract_layout)
+
+    text = text_cache.get(key)
+    if text is not None:
+        profile_utils.count('ocr.cache_hits')
+        return text
+
+    if text_disk_cache is not None:
+        text = text_disk_cache.get(key)
+        if text is not None:
+            with disk_cache_lock:
+                disk_cache_hits += 1
+            profile_utils.count('ocr.disk_cache_hits')
+            text_cache.put(key, text)
+            return text
+
+    with profile_utils.timer('ocr.tesseract'):
+        text = _run_tesseract(image_data, lang, tesseract_layout)
+    if text is None:
+        return ''
+    text_cache.put(key, text)
+    if text_disk_cache is not None:
+        text_disk_cache.put(key, text)
+    return text
 
 
-def _elem_has_down_border(image):
-    color = sum(image[image.shape[0] - 1]) / len(image[image.shape[0] - 1])
-    return color < border_limit_color
+def _run_tesseract(image_data, lang, tesseract_layout):
+    """Text of an image read by the OCR tool, None when the time left for the image runs out.
+    The Tesseract command configured in pyocr runs in a process that is killed at the deadline, the retries of
+    an image share its time. Other tools of pyocr can't be killed, so they read without a timeout."""
+    if ocr is not pyocr.tesseract:
+        return ocr.image_to_string(Image.fromarray(image_data), lang=lang,
+                                   builder=pyocr.builders.TextBuilder(tesseract_layout))
+
+    timeout = _time_left()
+    if timeout <= 0:
+        return None
+    image_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
+    try:
+        Image.fromarray(image_data).save(image_file)
+        image_file.close()
+        command = [pyocr.tesseract.TESSERACT_CMD, image_file.name, 'stdout',
+                   pyocr.tesseract.psm_parameter(), str(tesseract_layout)]
+        if lang:
+            command += ['-l', lang]
+        try:
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _timed_out(image_data)
+            return None
+        if result.returncode != 0:
+            raise pyocr.tesseract.TesseractError(result.returncode, result.stderr.decode('utf-8'))
+        return result.stdout.decode('utf-8').strip()
+    finally:
+        image_file.close()
+        os.remove(image_file.name)
+
+
+def _timed_out(image_data):
+    profile_utils.count('ocr.timeouts')
+    logger.warn('OCR timed out after %gs reading an image of %dx%d' %
+                (config['ocr_timeout'], image_data.shape[0], image_data.shape[1]))
 
 
-def _elem_has_left_border(image):
-    color = sum(image[:, 0]) / len(image[:, 0])
-    return color < border_limit_color
+def _remove_elem_border(image, extra=0.):
+    size = min(image.shape[0], image.shape[1])
+    max_trim = max((size // 2) - 1, 0)
 
+    # Remove the dark rows on top and bottom, then the dark columns on the sides of what is left
+    dark_rows = image.sum(axis=1) / image.shape[1] < border_limit_color
+    top = min(_leading_count(dark_rows), max_trim)
+    bottom = min(_leading_count(dark_rows[top:][::-1]), max_trim)
+    image = image[top:image.shape[0] - bottom, :]
 
-def _elem_has_right_border(image):
-    color = sum(image[:, image.shape[1] - 1]) / len(image[:, image.shape[1] - 1])
-    return color < border_limit_color
+    dark_columns = image.sum(axis=0) / image.shape[0] < border_limit_color
+    left = min(_leading_count(dark_columns), max_trim)
+    right = min(_leading_count(dark_columns[left:][::-1]), max_trim)
+    return image[:, left:image.shape[1] - right]
 
 
 def _remove_user_border(image, extra=0.):
     size = min(image.shape[0], image.shape[1])
-    i = 0
-    while _user_has_border(image) and i < size // 3:
-        i += 1
-        image = image[1:image.shape[0] - 1, 1:image.shape[1] - 1]
-    for i in range(int(size * extra)):
-        image = image[1:image.shape[0] - 1, 1:image.shape[1] - 1]
-    return image
-
-
-def _user_has_border(image):
-    color = max(image[0, 0], image[image.shape[0] - 1, 0], image[0, image.shape[1] - 1],
-                image[image.shape[0] - 1, image.shape[1] - 1])
-    return color > user_border_limit_color
+    height = image.shape[0]
+    width = image.shape[1]
+
+    # Brightest corner of the image after removing each number of borders
+    trims = np.arange(size // 3)
+    corners = np.max([
+        image[trims, trims],
+        image[height - 1 - trims, trims],
+        image[trims, width - 1 - trims],
+        image[height - 1 - trims, width - 1 - trims]
+    ], axis=0)
+    trim = _leading_count(corners > user_border_limit_color) + int(size * extra)
+    return image[trim:height - trim, trim:width - trim]
+
+
+def _leading_count(mask):
+    """Number of true values at the start of a mask"""
+    return len(mask) if mask.all() else int(np.argmin(mask))
 
 
 def _map_language(lang):
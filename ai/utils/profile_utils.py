@@ -0,0 +1,117 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from utils.logger import Logger
+
+logger = Logger('profile_utils')
+
+_local = threading.local()
+
+
+class Profile:
+    """Timers and counters of one run, like a board or a training session.
+    It can be shared by the threads working on the run."""
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [seconds, 1]
+            else:
+                timer[0] += seconds
+                timer[1] += 1
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'timers': {name: {'seconds': round(total, 6), 'calls': calls}
+                           for name, (total, calls) in sorted(self.timers.items())},
+                'counters': dict(sorted(self.counters.items()))
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+
+def start():
+    """Start profiling the current thread, returns its new profile"""
+    _local.profile = Profile()
+    return _local.profile
+
+
+def stop():
+    """Stop profiling the current thread, returns the profile it had"""
+    profile = current()
+    _local.profile = None
+    return profile
+
+
+def current():
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def activate(profile):
+    """Record in a profile on the current thread, e.g. in a worker doing part of a run"""
+    previous = current()
+    _local.profile = profile
+    try:
+        yield profile
+    finally:
+        _local.profile = previous
+
+
+@contextmanager
+def timer(name):
+    """Time a block in the current profile, it does nothing when the thread is not profiled"""
+    profile = current()
+    if profile is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_time(name, time.perf_counter() - start_time)
+
+
+def count(name, value=1):
+    """Add to a counter of the current profile, it does nothing when the thread is not profiled"""
+    profile = current()
+    if profile is not None:
+        profile.count(name, value)
+
+
+def timed(name):
+    """Decorator to time every call of a function in the current profile"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(function):
+    """Wrap a function to record in the profile of the calling thread, to be run by a thread pool"""
+    profile = current()
+    if profile is None:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with activate(profile):
+            return function(*args, **kwargs)
+    return wrapper
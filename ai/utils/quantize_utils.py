@@ -0,0 +1,47 @@
+import numpy as np
+from numpy_model import NumpyModel, QuantizedNumpyModel
+from utils.logger import Logger
+
+logger = Logger('quantize_utils')
+
+# Fully connected layers with almost all the weights and operations of the model
+quantized_layers = ['fc1', 'fc2']
+
+
+def compare_accuracy(weight_values, quantized_values, dataset):
+    """Accuracy of the model on a dataset with the float32 weights and with the quantized ones"""
+    return evaluate(NumpyModel(weight_values), dataset), evaluate(QuantizedNumpyModel(quantized_values), dataset)
+
+
+def save_quantized_weights(values, quantized_file):
+    np.savez(quantized_file, **values)
+    logger.info('Quantized weights saved in file: %s' % quantized_file)
+
+
+def quantize_weights(weight_values, quantization):
+    """Values of the quantized weights file, with the fully connected layers in int8 or float16.
+    int8 weights have a symmetric scale per output neuron. The file is smaller, QuantizedNumpyModel still runs
+    the layers in float32."""
+    values = dict(weight_values)
+    for layer in quantized_layers:
+        weights = np.asarray(weight_values[layer + '_weights'], dtype=np.float32)
+        if quantization == 'float16':
+            values[layer + '_weights'] = weights.astype(np.float16)
+        elif quantization == 'int8':
+            scale = np.maximum(np.abs(weights).max(axis=0), 1e-12) / 127
+            values[layer + '_weights'] = np.clip(np.rint(weights / scale), -127, 127).astype(np.int8)
+            values[layer + '_weights_scale'] = scale.astype(np.float32)
+        else:
+            raise ValueError('Unknown quantization: %s' % quantization)
+    values['quantization'] = np.array(quantization)
+    values['quantized_layers'] = np.array(quantized_layers)
+    return values
+
+
+def evaluate(model, dataset, batch_size=1000):
+    """Accuracy of a numpy model on a dataset"""
+    correct = 0
+    for offset in range(0, len(dataset), batch_size):
+        images, labels = dataset.get(np.arange(offset, min(offset + batch_size, len(dataset))))
+        correct += np.sum(np.argmax(model.predict(images), axis=1) == labels)
+    return float(correct) / max(len(dataset), 1)
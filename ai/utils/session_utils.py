@@ -0,0 +1,41 @@
+import os
+from contextlib import contextmanager
+import tensorflow as tf
+from config import config
+from utils.logger import Logger
+
+logger = Logger('session_utils')
+
+
+def create_session(graph=None):
+    """TensorFlow session with the threading and placement of the session config.
+    Every process creating a session should use it, so N workers x M threads can share a host predictably."""
+    session_config = config['session']
+    set_cpu_affinity(session_config['cpu_affinity'])
+    proto = tf.ConfigProto(intra_op_parallelism_threads=session_config['intra_op_threads'],
+                           inter_op_parallelism_threads=session_config['inter_op_threads'],
+                           allow_soft_placement=session_config['allow_soft_placement'],
+                           log_device_placement=session_config['log_device_placement'])
+    return tf.Session(graph=graph, config=proto)
+
+
+@contextmanager
+def device_scope():
+    """Place the ops created inside on the configured device, or let TensorFlow place them if there is none"""
+    device = config['session']['device']
+    if device:
+        with tf.device(device):
+            yield
+    else:
+        yield
+
+
+def set_cpu_affinity(cpus):
+    """Restrict the current process to a list of CPUs, no restriction if it is empty"""
+    if not cpus:
+        return
+    if not hasattr(os, 'sched_setaffinity'):
+        logger.warn('CPU affinity is not supported on this platform')
+        return
+    os.sched_setaffinity(0, cpus)
+    logger.debug('Process bound to CPUs %s' % list(cpus))
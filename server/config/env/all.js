@@ -21,5 +21,9 @@ module.exports = {
   },
   crypto: {
     bcrypt_salt_factor: +process.env.BCRYPT_SALT_FACTOR || 8
+  },
+  ai: {
+    // Milliseconds a board can take in the worker before it is restarted
+    board_timeout: +process.env.AI_BOARD_TIMEOUT || 120000
   }
 };
\ No newline at end of file
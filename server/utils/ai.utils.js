@@ -1,9 +1,17 @@
-const exec = require('child_process').exec;
+const spawn = require('child_process').spawn;
+const readline = require('readline');
+const config = require('config');
 const Relation = require('models/relation.model');
 const Item = require('models/item.model');
+const Logger = require('utils/logger');
+const logger = new Logger('AI Utils');
 
 module.exports = {
 
+  _worker: null,
+  _pending: new Map(),
+  _nextRequestId: 1,
+
   /**
    * Updates a board with the elements extracted from an image
    */
@@ -22,22 +30,116 @@ module.exports = {
   },
 
   /**
-   * Extracts board elements from an image
+   * Extracts board elements from an image, using a worker that keeps the model loaded.
+   * A board that takes longer than the timeout is rejected and the worker is restarted.
    */
   processImage(image, language) {
     return new Promise((resolve, reject) => {
-      const cmd = `cd ai; python3 ./process_board.py -i ${image} -l ${language}`;
-      exec(cmd, (error, stdout) => {
-        if (error) {
-          return reject(error);
-        }
-        try {
-          resolve(JSON.parse(stdout.trim()));
-        } catch (e) {
-          reject(e);
-        }
-      });
+      const id = this._nextRequestId++;
+      const timer = setTimeout(() => this._onRequestTimeout(id), config.ai.board_timeout);
+      this._pending.set(id, { resolve, reject, timer });
+      this._getWorker().stdin.write(JSON.stringify({ id, image, lang: language }) + '\n');
+    });
+  },
+
+  /**
+   * Returns the running worker, starting a new one if needed
+   *
+   * @private
+   */
+  _getWorker() {
+    if (this._worker) {
+      return this._worker;
+    }
+
+    const worker = spawn('python3', ['./process_board.py', '--serve'], {
+      cwd: 'ai',
+      stdio: ['pipe', 'pipe', 'inherit']
+    });
+    this._worker = worker;
+
+    readline.createInterface({ input: worker.stdout }).on('line', line => this._onWorkerResponse(worker, line));
+    worker.on('error', err => this._onWorkerExit(worker, err));
+    worker.on('exit', code => this._onWorkerExit(worker, new Error(`Board worker exited with code ${code}`)));
+
+    return worker;
+  },
+
+  /**
+   * Resolves the request of a worker response, the lines of a stopped worker are ignored
+   *
+   * @private
+   */
+  _onWorkerResponse(worker, line) {
+    if (this._worker !== worker) {
+      return;
+    }
+    let data;
+    try {
+      data = JSON.parse(line.trim());
+    } catch (e) {
+      logger.error('Invalid response from board worker:', line);
+      return this._restartWorker(new Error('Invalid response from board worker'));
+    }
+    const request = data && this._pending.get(data.id);
+    if (!request) {
+      // The responses no longer match the requests, none of the pending ones can be trusted
+      logger.error('Response from board worker without a pending request:', line);
+      return this._restartWorker(new Error('Unexpected response from board worker'));
+    }
+    this._pending.delete(data.id);
+    clearTimeout(request.timer);
+    if (data.error) {
+      return request.reject(new Error(data.error));
+    }
+    logger.debug('Board processed in', data.timings);
+    delete data.id;
+    delete data.timings;
+    request.resolve(data);
+  },
+
+  /**
+   * Rejects a request that took longer than the timeout, and the others waiting for the same worker
+   *
+   * @private
+   */
+  _onRequestTimeout(id) {
+    if (!this._pending.has(id)) {
+      return;
+    }
+    logger.error('Board worker timed out processing request', id);
+    this._restartWorker(new Error(`Board worker timed out after ${config.ai.board_timeout} ms`));
+  },
+
+  /**
+   * Stops the running worker rejecting its pending requests, the next request starts a new one
+   *
+   * @private
+   */
+  _restartWorker(err) {
+    const worker = this._worker;
+    if (!worker) {
+      return;
+    }
+    this._onWorkerExit(worker, err);
+    worker.kill('SIGKILL');
+  },
+
+  /**
+   * Rejects the pending requests of a worker that stopped, the next request starts a new one
+   *
+   * @private
+   */
+  _onWorkerExit(worker, err) {
+    if (this._worker !== worker) {
+      return;
+    }
+    this._worker = null;
+    this._pending.forEach(request => {
+      clearTimeout(request.timer);
+      request.reject(err);
     });
+    this._pending.clear();
   }
 
-};
\ No newline at end of file
+};